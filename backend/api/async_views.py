@@ -0,0 +1,140 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import QuerySet
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+
+class AsyncViewSetMixin:
+    """Асинхронные варианты безопасных действий вьюсета для режима ASGI.
+    Если включена настройка ASYNC_READ_VIEWS, GET запросы к действиям
+    async_actions выполняет корутина a<действие> вьюсета, остальные
+    запросы - синхронная вьюха вьюсета. Разбор запроса, права доступа,
+    обработка ошибок и рендеринг общие с синхронными действиями,
+    асинхронно выполняются только обращения к базе данных и кэшу.
+    Миксины вьюсетов, которые дополняют dispatch, initial и действия,
+    дополняют и их асинхронные варианты"""
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_READ_VIEWS or not cls.async_actions:
+            return sync_view
+
+        async def view(request, *args, **kwargs):
+            action = sync_view.actions.get(request.method.lower())
+            if request.method != 'GET' or action not in cls.async_actions:
+                return await sync_to_async(sync_view)(
+                    request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.action_map = sync_view.actions
+            for method, name in sync_view.actions.items():
+                setattr(self, method, getattr(self, name))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        # метрики определяют действие вьюсета по этим атрибутам
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = sync_view.actions
+        view.csrf_exempt = True
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """Асинхронный вариант dispatch"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        """Асинхронный вариант initial: запрос аутентифицируется
+        асинхронно, остальные проверки DRF не обращаются к базе данных"""
+        await self.aperform_authentication(request)
+        super().initial(request, *args, **kwargs)
+
+    async def aperform_authentication(self, request):
+        """Асинхронный вариант Request._authenticate: аутентификаторы
+        с методом aauthenticate не занимают поток"""
+        for authenticator in request.authenticators:
+            aauthenticate = getattr(authenticator, 'aauthenticate', None)
+            if aauthenticate is None:
+                aauthenticate = sync_to_async(authenticator.authenticate)
+            try:
+                user_auth_tuple = await aauthenticate(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def afilter_queryset(self, queryset):
+        """Фильтры проверяют параметры по базе данных (теги, авторы),
+        поэтому выполняются синхронно"""
+        return await sync_to_async(self.filter_queryset)(queryset)
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(
+            queryset, self.request, view=self)
+
+    async def aget_object(self):
+        """Асинхронный вариант get_object"""
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{
+                self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginated_response(self, queryset):
+        """Ответ со страницей объектов или со всеми объектами, если
+        параметры пагинации не переданы"""
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        if isinstance(queryset, QuerySet):
+            queryset = [obj async for obj in queryset]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        return await self.apaginated_response(queryset)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
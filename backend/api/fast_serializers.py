@@ -0,0 +1,97 @@
+from operator import attrgetter
+
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField, is_simple_callable
+from rest_framework.relations import PKOnlyObject
+
+from core.metrics import serialization_timer
+
+
+def compile_field(field):
+    """Возвращает функцию, которая выводит значение поля объекта так же,
+    как Serializer.to_representation. SkipField пропускает поле"""
+    if isinstance(field, serializers.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+
+    if isinstance(field, serializers.ListSerializer):
+        child = compile_serializer(field.child)
+        return compile_plain(field, lambda items: [
+            child(item) for item in (
+                items.all() if isinstance(items, models.manager.BaseManager)
+                else items)
+        ])
+
+    if isinstance(field, (serializers.RelatedField,
+                          serializers.ManyRelatedField,
+                          serializers.BaseSerializer)):
+        return compile_generic(field)
+
+    return compile_plain(field, field.to_representation)
+
+
+def compile_generic(field):
+    """Вывод поля теми же вызовами, что и в DRF"""
+    def represent(instance):
+        attribute = field.get_attribute(instance)
+        value = (attribute.pk if isinstance(attribute, PKOnlyObject)
+                 else attribute)
+        return None if value is None else field.to_representation(attribute)
+    return represent
+
+
+def compile_plain(field, to_representation):
+    """Вывод поля с простым источником: атрибут читается напрямую,
+    а отсутствующие атрибуты и методы обрабатывает field.get_attribute"""
+    if field.source == '*':
+        return compile_generic(field)
+
+    get = attrgetter(field.source)
+
+    def represent(instance):
+        try:
+            value = get(instance)
+        except AttributeError:
+            value = field.get_attribute(instance)
+        else:
+            if is_simple_callable(value):
+                value = field.get_attribute(instance)
+        return None if value is None else to_representation(value)
+    return represent
+
+
+def compile_serializer(serializer):
+    """Возвращает функцию, которая преобразует объект в словарь так же,
+    как serializer.to_representation. Поля сериализатора обходятся один
+    раз при компиляции, поля-методы, которые строят вложенные
+    сериализаторы, сериализатор заменяет в compile_methods"""
+    methods = getattr(serializer, 'compile_methods', dict)()
+    getters = [
+        (name, methods[name] if name in methods else compile_field(field))
+        for name, field in serializer.fields.items()
+        if not field.write_only
+    ]
+
+    def represent(instance):
+        data = {}
+        for name, get in getters:
+            try:
+                data[name] = get(instance)
+            except SkipField:
+                pass
+        return data
+    return represent
+
+
+class CompiledListSerializer(serializers.ListSerializer):
+    """Список только для чтения, который выводит объекты функцией,
+    скомпилированной из дочернего сериализатора один раз на весь список"""
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager)
+                     else data)
+        if not items:
+            return []
+
+        with serialization_timer():
+            represent = compile_serializer(self.child)
+            return [represent(item) for item in items]
@@ -1,4 +1,19 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from rest_framework import mixins, viewsets
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from core.cache import aget_or_build, get_or_build, make_key
+from core.conditional import (aconditional_response, conditional_response,
+                              detail_validators, get_ordering_generations,
+                              list_validators, relations_changed)
+from core.counters import change_counter, suspend_counters
+from core.db_router import (ais_pinned, is_pinned, pin_to_primary,
+                            primary_reads, replica_reads)
+from core.field_selection import FieldSelection
+from .serializers import IdListSerializer
 
 
 class ListRetrieveCreateViewSet(
@@ -8,3 +23,223 @@ class ListRetrieveCreateViewSet(
     viewsets.GenericViewSet
 ):
     pass
+
+
+class AnonymousCacheMixin:
+    """Кэширует данные списка для анонимных пользователей. Ключ зависит
+    от адреса, параметров запроса, поколений данных cache_generations
+    и поколений ordering_generations для сортировки по их полям"""
+    cache_generations = ()
+    ordering_generations = {}
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+
+        build_list = super().list
+        key = self.get_cache_key(request)
+        # кэшируемые данные строятся по основной базе, иначе отставшая
+        # реплика попадет в кэш нового поколения
+        with primary_reads():
+            data = get_or_build(
+                key, lambda: build_list(request, *args, **kwargs).data)
+        return Response(data)
+
+    async def alist(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await super().alist(request, *args, **kwargs)
+
+        build_list = super().alist
+
+        async def build_data():
+            return (await build_list(request, *args, **kwargs)).data
+
+        key = await sync_to_async(self.get_cache_key)(request)
+        with primary_reads():
+            data = await aget_or_build(key, build_data)
+        return Response(data)
+
+    def get_cache_key(self, request):
+        url = request.build_absolute_uri(request.path)
+        return make_key(
+            f'{type(self).__name__}:{url}',
+            (*self.cache_generations, *get_ordering_generations(
+                request.query_params, self.ordering_generations)),
+            request.query_params
+        )
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на условные запросы списка и объекта, не строя
+    ответ. Версия списка определяется поколениями cache_generations
+    и поколениями ordering_generations для сортировки по их полям,
+    версия объекта - его полем updated_field"""
+    cache_generations = ()
+    ordering_generations = {}
+    updated_field = 'updated_at'
+
+    def list(self, request, *args, **kwargs):
+        build_list = super().list
+        return conditional_response(
+            request, self.get_list_validators(request),
+            lambda: build_list(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        build_list = super().alist
+        validators = await sync_to_async(self.get_list_validators)(request)
+        return await aconditional_response(
+            request, validators,
+            lambda: build_list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_object_validators(request)
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        build_object = super().retrieve
+        return conditional_response(
+            request, validators,
+            lambda: build_object(request, *args, **kwargs))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        validators = await sync_to_async(self.get_object_validators)(
+            request)
+        if validators is None:
+            return await super().aretrieve(request, *args, **kwargs)
+
+        build_object = super().aretrieve
+        return await aconditional_response(
+            request, validators,
+            lambda: build_object(request, *args, **kwargs))
+
+    def get_list_validators(self, request):
+        return list_validators(
+            request, request.accepted_media_type, self.cache_generations,
+            self.ordering_generations)
+
+    def get_object_validators(self, request):
+        """ETag и время изменения объекта или None, если объекта нет"""
+        updated_at = self.get_updated_at()
+        if updated_at is None:
+            return None
+
+        return detail_validators(
+            request, request.accepted_media_type, updated_at)
+
+    def get_updated_at(self):
+        """Дата изменения объекта одним запросом по первичному ключу
+        или None, если объекта нет: ответ 404 строит retrieve"""
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.queryset.filter(**{
+                self.lookup_field: self.kwargs[lookup]
+            }).values_list(self.updated_field, flat=True).first()
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+
+class FieldSelectionMixin:
+    """Передает сериализаторам поля ответа, выбранные параметрами
+    fields и expand запроса"""
+    def get_field_selection(self):
+        return FieldSelection.from_request(self.request)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_field_selection()
+        return context
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы читают из реплик, если автор запроса недавно
+    ничего не менял. Успешный небезопасный запрос закрепляет автора
+    за основной базой. Аутентификация всегда читает из основной базы"""
+    def dispatch(self, request, *args, **kwargs):
+        with primary_reads():
+            response = super().dispatch(request, *args, **kwargs)
+        if (self.request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            pin_to_primary(self.request.user)
+        return response
+
+    async def adispatch(self, request, *args, **kwargs):
+        """Асинхронно выполняются только безопасные запросы"""
+        with primary_reads():
+            return await super().adispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned(request.user):
+            replica_reads.set(True)
+
+    async def ainitial(self, request, *args, **kwargs):
+        await super().ainitial(request, *args, **kwargs)
+        if not await ais_pinned(request.user):
+            replica_reads.set(True)
+
+
+def lock_owner(user):
+    """Блокирует строку пользователя до конца транзакции, чтобы изменения
+    его связей выполнялись по очереди: прочитанные связи не меняются
+    другими запросами до изменения счетчиков. Блокировка не мешает
+    ссылаться на пользователя из других таблиц"""
+    list(type(user).objects.select_for_update(no_key=True).filter(
+        pk=user.pk).values_list('pk', flat=True))
+
+
+class BatchRelationMixin:
+    """Массовое добавление и удаление связей автора запроса с объектами
+    в одной транзакции, с результатом по каждому переданному id.
+    Связи читаются и меняются под блокировкой автора запроса, поэтому
+    счетчики меняются только на действительно добавленные и удаленные
+    связи. Обработчики удаления связей, которые проверяют suspended, не
+    вызываются: вместо них вызывается on_change с измененными id.
+    При изменениях меняются поколение связей автора запроса
+    и поколения generations"""
+    def batch_relation(self, request, model, owner_field, target_field,
+                       targets, counter=None, excluded=(), on_change=None,
+                       generations=()):
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = set(targets.filter(id__in=ids).values_list('id', flat=True))
+        relations = model.objects.filter(**{
+            owner_field: request.user, f'{target_field}__in': ids})
+        with transaction.atomic():
+            lock_owner(request.user)
+            linked = set(relations.values_list(target_field, flat=True))
+            if request.method == 'POST':
+                changed = [object_id for object_id in ids
+                           if object_id in found
+                           and object_id not in linked
+                           and object_id not in excluded]
+                model.objects.bulk_create([
+                    model(**{owner_field: request.user,
+                             target_field: object_id})
+                    for object_id in changed
+                ], ignore_conflicts=True)
+                done, skipped, delta = 'added', 'already_added', 1
+            else:
+                changed = [object_id for object_id in ids
+                           if object_id in linked]
+                with suspend_counters():
+                    relations.delete()
+                done, skipped, delta = 'removed', 'not_added', -1
+            if counter is not None:
+                change_counter(*counter, changed, delta)
+            if on_change is not None and changed:
+                on_change(changed, delta)
+            if changed:
+                relations_changed(request.user.id, *generations)
+
+        changed = set(changed)
+        results = []
+        for object_id in ids:
+            if object_id not in found:
+                result = 'not_found'
+            elif object_id in excluded:
+                result = 'not_allowed'
+            else:
+                result = done if object_id in changed else skipped
+            results.append({'id': object_id, 'status': result})
+        return Response(results)
@@ -1,11 +1,22 @@
 import base64
+import binascii
+from collections import Counter
+from io import BytesIO
 
+from PIL import Image
 from rest_framework import serializers
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import transaction
 
+from core.counters import suspend_counters
+from core.field_selection import FieldSelection
+from core.images import has_image_signature, schedule_image_processing
+from core.metrics import TimedSerializerMixin
 from core.models import Tag, Ingredient
 from recipes.models import Recipe, IngredientInRecipe, Favorite, ShoppingCart
 from users.models import User, Subscribe
+from .fast_serializers import CompiledListSerializer, compile_serializer
 
 
 class Base64ImageField(serializers.ImageField):
@@ -14,25 +25,97 @@ class Base64ImageField(serializers.ImageField):
         if isinstance(data, str) and data.startswith('data:image'):
             file_format, img_code = data.split(';base64,')
             ext = file_format.split('/')[-1]
-            data = ContentFile(base64.b64decode(img_code), name='temp.' + ext)
+            if len(img_code) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise serializers.ValidationError(
+                    'Размер изображения превышает допустимый')
+
+            try:
+                header = base64.b64decode(img_code[:16])
+                if not has_image_signature(header):
+                    raise serializers.ValidationError(
+                        'Загруженный файл не является изображением')
+
+                content = base64.b64decode(img_code)
+            except binascii.Error:
+                raise serializers.ValidationError(
+                    'Некорректное изображение в формате base64')
+
+            self.check_dimensions(content)
+            data = ContentFile(content, name='temp.' + ext)
         return super().to_internal_value(data)
 
-
-class TagSerializer(serializers.ModelSerializer):
+    def check_dimensions(self, content):
+        """Проверяет размеры изображения по заголовку без декодирования"""
+        try:
+            with Image.open(BytesIO(content)) as image:
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            raise serializers.ValidationError(
+                'Загруженный файл не является изображением')
+
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise serializers.ValidationError(
+                'Разрешение изображения превышает допустимое')
+
+
+class SparseFieldsMixin:
+    """Оставляет в ответе поля, выбранные параметрами fields и expand.
+    Выбор передается аргументом selection, корневой сериализатор берет
+    его из контекста. Связи из Meta.compact_fields, которые выбраны
+    без expand, выводятся id"""
+    def __init__(self, *args, selection=None, **kwargs):
+        self._selection = selection
+        super().__init__(*args, **kwargs)
+
+    @property
+    def selection(self):
+        if self._selection is None:
+            self._selection = self.context.get('fields') or FieldSelection()
+        return self._selection
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.selection
+        if selection.fields is None:
+            return fields
+
+        unknown = selection.unknown(fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': 'Неизвестные поля: {0}'.format(', '.join(unknown))})
+
+        fields = {name: field for name, field in fields.items()
+                  if selection.includes(name)}
+        for name in getattr(self.Meta, 'compact_fields', ()):
+            if name in fields and not selection.expands(name):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True,
+                    many=self.Meta.model._meta.get_field(name).many_to_many)
+        for name, field in fields.items():
+            field = getattr(field, 'child', field)
+            if isinstance(field, SparseFieldsMixin):
+                field._selection = selection.nested(name)
+        return fields
+
+
+class TagSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                    serializers.ModelSerializer):
     """Сериализатор тегов"""
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор ингредиентов"""
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                     serializers.ModelSerializer):
     """Сериализатор пользователей при безопасных запросах"""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
@@ -40,9 +123,13 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed')
+        list_serializer_class = CompiledListSerializer
 
     def get_is_subscribed(self, user):
         """Проверяет подписку автора запроса на запрашиваемого пользователя"""
+        if hasattr(user, 'is_subscribed'):
+            return user.is_subscribed
+
         subscriber = self.context.get('request').user
         return Subscribe.objects.filter(
             subscriber=subscriber.id, author=user.id).exists()
@@ -68,7 +155,8 @@ class SetPasswordSerializer(serializers.ModelSerializer):
         fields = ('new_password', 'current_password')
 
 
-class IngredientInRecipeSerializer(serializers.ModelSerializer):
+class IngredientInRecipeSerializer(SparseFieldsMixin,
+                                   serializers.ModelSerializer):
     """Сериализатор для ингредиентов в рецепте"""
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(
@@ -79,10 +167,11 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                       serializers.ModelSerializer):
     """Сериализатор рецептов"""
     tags = TagSerializer(many=True)
-    author = UserSerializer()
+    author = serializers.SerializerMethodField()
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -91,29 +180,97 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'image_medium', 'image_small',
+                  'text', 'cooking_time')
+        compact_fields = ('tags', 'author')
+        list_serializer_class = CompiledListSerializer
+
+    def compile_methods(self):
+        """Автор и ингредиенты для скомпилированного списка: вложенные
+        сериализаторы строятся один раз на весь список"""
+        methods = {}
+        if isinstance(self.fields.get('author'),
+                      serializers.SerializerMethodField):
+            represent_user = compile_serializer(UserSerializer(
+                context=self.context,
+                selection=self.selection.nested('author')))
+            methods['author'] = lambda recipe: represent_user(
+                self.get_author_object(recipe))
+        if 'ingredients' in self.fields:
+            represent_ingredient = compile_serializer(
+                IngredientInRecipeSerializer(
+                    selection=self.selection.nested('ingredients')))
+            methods['ingredients'] = lambda recipe: [
+                represent_ingredient(ingredient)
+                for ingredient in recipe.ingredients_in_recipes.all()
+            ]
+        return methods
+
+    @staticmethod
+    def get_author_object(recipe):
+        """Автор рецепта с признаком подписки на него"""
+        author = recipe.author
+        if hasattr(recipe, 'is_subscribed'):
+            author.is_subscribed = recipe.is_subscribed
+        return author
+
+    def get_author(self, recipe):
+        """Получение автора рецепта с признаком подписки на него"""
+        return UserSerializer(self.get_author_object(recipe),
+                              context=self.context,
+                              selection=self.selection.nested('author')).data
 
     def get_ingredients(self, recipe):
         """Получение всех ингредиентов в рецепте"""
         ingredients = recipe.ingredients_in_recipes.all()
-        return IngredientInRecipeSerializer(ingredients, many=True).data
+        return IngredientInRecipeSerializer(
+            ingredients, many=True,
+            selection=self.selection.nested('ingredients')).data
 
     def get_is_favorited(self, recipe):
         """Проверяет находится ли рецепт в избранном"""
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+
         user = self.context.get('request').user
         return Favorite.objects.filter(
             user=user.id, recipe=recipe.id).exists()
 
     def get_is_in_shopping_cart(self, recipe):
         """Проверяет находится ли рецепт в списке покупок"""
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+
         user = self.context.get('request').user
         return ShoppingCart.objects.filter(
             user=user.id, recipe=recipe.id).exists()
 
 
+def resolve_ids(model, ids, name):
+    """Находит объекты model по списку id одним запросом и возвращает их
+    в порядке ids. Обо всех отсутствующих и повторяющихся id сообщает
+    одна ошибка"""
+    found = model.objects.in_bulk(ids)
+    missing = [str(object_id) for object_id in dict.fromkeys(ids)
+               if object_id not in found]
+    duplicates = [str(object_id) for object_id, count in Counter(ids).items()
+                  if count > 1]
+    errors = []
+    if missing:
+        errors.append('{0} не найдены: {1}'.format(name, ', '.join(missing)))
+    if duplicates:
+        errors.append('{0} повторяются: {1}'.format(
+            name, ', '.join(duplicates)))
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    return [found[object_id] for object_id in ids]
+
+
 class CreateIngredientInRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для добавления ингредиентов в рецепт"""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    """Сериализатор для добавления ингредиентов в рецепт. Ингредиенты
+    по id находит сериализатор рецепта, одним запросом на все"""
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1, write_only=True)
 
     class Meta:
@@ -124,10 +281,7 @@ class CreateIngredientInRecipeSerializer(serializers.ModelSerializer):
 class CreateRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецептов"""
     ingredients = CreateIngredientInRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     image = Base64ImageField()
 
     class Meta:
@@ -135,6 +289,19 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         fields = ('ingredients', 'tags', 'image',
                   'name', 'text', 'cooking_time')
 
+    def validate_ingredients(self, ingredients):
+        """Заменяет id ингредиентов найденными ингредиентами"""
+        found = resolve_ids(
+            Ingredient, [ingredient['id'] for ingredient in ingredients],
+            'Ингредиенты')
+        return [{**ingredient, 'id': ingredient_object}
+                for ingredient, ingredient_object in zip(ingredients, found)]
+
+    def validate_tags(self, tags):
+        """Заменяет id тегов найденными тегами"""
+        return resolve_ids(Tag, tags, 'Теги')
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта"""
         ingredients_in_recipe = validated_data.pop('ingredients')
@@ -148,40 +315,121 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             amount=ingredient.get('amount')
         ) for ingredient in ingredients_in_recipe]
         IngredientInRecipe.objects.bulk_create(ingredients)
+        schedule_image_processing(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        """Обновление существующего рецепта"""
-        new_ingredients_in_recipe = validated_data.get('ingredients')
-        instance.tags.set(validated_data.get('tags'))
-        instance.image = validated_data.get('image')
-        instance.name = validated_data.get('name')
-        instance.text = validated_data.get('text')
-        instance.cooking_time = validated_data.get('cooking_time')
-        instance.ingredients_in_recipes.all().delete()
-        ingredients = [IngredientInRecipe(
-            recipe=instance,
-            ingredient=ingredient.get('id'),
-            amount=ingredient.get('amount')
-        ) for ingredient in new_ingredients_in_recipe]
-        IngredientInRecipe.objects.bulk_create(ingredients)
-        instance.save()
+        """Обновление существующего рецепта: меняются только переданные
+        и отличающиеся от текущих поля, изображение заменяется, только
+        если передано новое"""
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        image = validated_data.pop('image', None)
+        changed_fields = [field for field, value in validated_data.items()
+                          if getattr(instance, field) != value]
+        for field in changed_fields:
+            setattr(instance, field, validated_data[field])
+        if image is not None:
+            instance.image = image
+            instance.image_medium = instance.image_small = ''
+            changed_fields += ['image', 'image_medium', 'image_small']
+        relations_changed = [
+            tags is not None and self.update_tags(instance, tags),
+            ingredients is not None and self.update_ingredients(
+                instance, ingredients)
+        ]
+        # сохраняются только измененные поля: счетчики рецепта меняются
+        # запросами в обход модели и не должны перезаписываться
+        if changed_fields or any(relations_changed):
+            instance.save(update_fields=[*changed_fields, 'updated_at'])
+        if image is not None:
+            schedule_image_processing(instance.id)
         return instance
 
+    def update_tags(self, recipe, tags):
+        """Меняет теги рецепта, если их набор изменился. Возвращает,
+        изменились ли теги"""
+        if {tag.id for tag in tags} == {tag.id for tag in recipe.tags.all()}:
+            return False
+
+        with suspend_counters():
+            recipe.tags.set(tags)
+        return True
+
+    def update_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к переданным: добавляет новые,
+        меняет количество измененных и удаляет лишние, не более одного
+        запроса на каждое действие. Возвращает, изменилось ли что-то.
+        Дату изменения рецепта и журнал индекса ингредиентов обновляет
+        сохранение рецепта в update"""
+        current = {item.ingredient_id: item
+                   for item in recipe.ingredients_in_recipes.all()}
+        amounts = {ingredient['id'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        removed = [item.id for ingredient_id, item in current.items()
+                   if ingredient_id not in amounts]
+        added = []
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                added.append(IngredientInRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount))
+            elif item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+
+        if removed:
+            with suspend_counters():
+                IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientInRecipe.objects.bulk_create(added)
+        return bool(removed or changed or added)
+
     def to_representation(self, instance):
-        """Выбор сериализатора для преобразования данных"""
-        serializer = RecipeSerializer(instance, context=self.context)
+        """Выбор сериализатора для преобразования данных. Рецепт
+        перечитывается вместе со связанными данными и признаками
+        фиксированным числом запросов"""
+        recipe = Recipe.objects.with_related().with_user_flags(
+            self.context.get('request').user).get(pk=instance.pk)
+        serializer = RecipeSerializer(recipe, context=self.context)
         return serializer.data
 
 
-class AddRecipeSerializer(serializers.ModelSerializer):
+class AddRecipeSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                          serializers.ModelSerializer):
     """Сериализатор для добавления рецепта в избранное или список покупок"""
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_medium', 'image_small',
+                  'cooking_time')
+
+
+class IdListSerializer(serializers.Serializer):
+    """Сериализатор списка id для массовых операций"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+
+class AvailableIngredientsSerializer(serializers.Serializer):
+    """Сериализатор параметров подбора рецептов по имеющимся
+    ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
 
 
-class AddUserSerializer(serializers.ModelSerializer):
+class AddUserSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                        serializers.ModelSerializer):
     "Сериализатор для подписки на пользователя"
     is_subscribed = serializers.BooleanField(default=True, read_only=True)
     recipes = serializers.SerializerMethodField()
@@ -191,12 +439,39 @@ class AddUserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
+        list_serializer_class = CompiledListSerializer
+
+    def compile_methods(self):
+        """Рецепты для скомпилированного списка: сериализатор рецептов
+        строится один раз на весь список"""
+        if 'recipes' not in self.fields:
+            return {}
+
+        represent_recipe = compile_serializer(AddRecipeSerializer(
+            selection=self.selection.nested('recipes')))
+        return {'recipes': lambda user: [
+            represent_recipe(recipe)
+            for recipe in self.get_recipe_objects(user)
+        ]}
+
+    def get_recipe_objects(self, user):
+        """Последние рецепты пользователя, их количество ограничивается
+        параметром recipes_limit"""
+        recipes = getattr(user, 'latest_recipes', None)
+        if recipes is None:
+            recipes = user.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:recipes_limit]
+        return recipes
 
     def get_recipes(self, user):
-        """Получает все рецепты пользователя"""
-        recipes = user.recipes.all()
-        return AddRecipeSerializer(recipes, many=True).data
+        """Получает последние рецепты пользователя, их количество
+        ограничивается параметром recipes_limit"""
+        return AddRecipeSerializer(
+            self.get_recipe_objects(user), many=True,
+            selection=self.selection.nested('recipes')).data
 
     def get_recipes_count(self, user):
         """Выводит количество рецептов, добавленных пользователем"""
-        return len(user.recipes.all())
+        return user.recipes_count
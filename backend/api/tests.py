@@ -0,0 +1,214 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from api.serializers import (RecipeSerializer, UserSerializer,
+                             AddUserSerializer)
+from api.views import get_recipes, get_subscriptions
+from core.field_selection import FieldSelection
+from core.models import Ingredient, Tag
+from core.renderers import FastJSONRenderer
+from recipes.models import Favorite, IngredientInRecipe, Recipe, ShoppingCart
+from users.models import User, Subscribe
+
+
+class CompiledSerializersTests(TestCase):
+    """Скомпилированные сериализаторы списков и FastJSONRenderer выводят
+    те же байты, что и сериализаторы и рендерер DRF"""
+    cases = {
+        'recipes': (RecipeSerializer, ''),
+        'recipe_cards': (RecipeSerializer, 'fields=id,name,image,'
+                         'cooking_time,author.first_name,'
+                         'author.last_name,tags'),
+        'recipes_compact': (RecipeSerializer,
+                            'fields=id,name,author,tags,is_favorited'),
+        'recipes_expand': (RecipeSerializer,
+                           'fields=id,author,tags&expand=author,tags'),
+        'users': (UserSerializer, ''),
+        'subscriptions': (AddUserSerializer, 'recipes_limit=3'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(
+                username=f'user{number}', email=f'user{number}@example.com',
+                first_name='Имя\u2028', last_name='Фамилия "в кавычках"')
+            for number in range(4)
+        ]
+        cls.user = cls.users[0]
+        tags = [Tag.objects.create(name=f'тег {number}', color='#E26C2D',
+                                   slug=f'tag{number}')
+                for number in range(3)]
+        ingredients = [Ingredient.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(4)]
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=cls.users[number % 4], name=f'рецепт {number}',
+                text='описание <b>\u2029 эмодзи \U0001f372',
+                cooking_time=number + 1, image='recipes/images/test.png')
+            recipe.tags.set(tags[:number % 3 + 1])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=number + 1)
+                for ingredient in ingredients[:number % 4 + 1])
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        for author in cls.users[1:3]:
+            Subscribe.objects.create(subscriber=cls.user, author=author)
+
+    def get_context(self, query):
+        request = Request(RequestFactory().get(f'/api/?{query}'))
+        request.user = self.user
+        return {'request': request,
+                'fields': FieldSelection.from_request(request),
+                'recipes_limit': 3}
+
+    def get_objects(self, case, context):
+        if case == 'users':
+            return User.objects.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(subscriber=self.user,
+                                         author=OuterRef('pk'))
+            )).order_by('id')
+        if case == 'subscriptions':
+            return get_subscriptions(self.user, context['recipes_limit'],
+                                     context['fields'])
+        return get_recipes(self.user, context['fields'])
+
+    def test_compiled_serializers_match_drf(self):
+        for case, (serializer_class, query) in self.cases.items():
+            with self.subTest(case=case):
+                context = self.get_context(query)
+                objects = list(self.get_objects(case, context))
+                self.assertTrue(objects)
+                drf = serializers.ListSerializer(
+                    objects, child=serializer_class(), context=context).data
+                compiled = serializer_class(
+                    objects, many=True, context=context).data
+                reference = JSONRenderer().render(drf)
+                self.assertEqual(JSONRenderer().render(compiled), reference)
+                self.assertEqual(FastJSONRenderer().render(compiled),
+                                 reference)
+
+    def test_fast_renderer_matches_drf(self):
+        data = {
+            'text': 'строка\u2028с разделителями\u2029 и "кавычками"',
+            'number': 1.5,
+            'nested': [None, True, {'key': []}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None),
+                         JSONRenderer().render(None))
+        self.assertEqual(
+            FastJSONRenderer().render(
+                data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class RecipeSearchTests(TestCase):
+    """Поиск рецептов сообщает, что количество результатов достигло
+    предела ранжирования"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com')
+        cls.recipes = [Recipe.objects.create(
+            author=cls.user, name=name, text=text, cooking_time=5,
+            image='recipes/images/test.png'
+        ) for name, text in (('суп', 'описание'), ('каша', 'описание'),
+                             ('щи', 'суп из капусты'),
+                             ('рыбный суп', 'описание'),
+                             ('борщ', 'описание'),
+                             ('окрошка', 'холодный суп'))]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        response = self.client.get(
+            '/api/recipes/', {'search': query, 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_all_matches_ranked(self):
+        data = self.search('суп')
+        self.assertEqual(data['count'], 4)
+        self.assertIs(data['truncated'], False)
+        # совпадения в названии выше совпадений в описании
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [self.recipes[3].id, self.recipes[0].id])
+
+    @override_settings(RECIPE_SEARCH_MAX_RESULTS=3)
+    def test_truncated(self):
+        data = self.search('суп')
+        self.assertEqual(data['count'], 3)
+        self.assertIs(data['truncated'], True)
+        # ранжируются только три последних подходящих рецепта
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [self.recipes[3].id, self.recipes[5].id])
+
+    def test_case_insensitive(self):
+        pancakes = Recipe.objects.create(
+            author=self.user, name='Блины', text='Тесто', cooking_time=5,
+            image='recipes/images/test.png')
+        mentioned = Recipe.objects.create(
+            author=self.user, name='Варенье', text='Подавать к БЛИНАМ',
+            cooking_time=5, image='recipes/images/test.png')
+        for query in ('блин', 'БЛИН', 'бЛиН'):
+            with self.subTest(query=query):
+                data = self.search(query)
+                self.assertEqual([recipe['id'] for recipe in data['results']],
+                                 [pancakes.id, mentioned.id])
+        data = self.search('бЛиНы тЕсТо')
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [pancakes.id])
+
+    def test_no_flag_without_search(self):
+        data = self.client.get('/api/recipes/', {'limit': 2}).json()
+        self.assertNotIn('truncated', data)
+
+
+class AnonymousRecipeCacheTests(TestCase):
+    """Кэш списков рецептов для анонимных пользователей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='fan', email='fan@example.com')
+        cls.recipes = [Recipe.objects.create(
+            author=cls.user, name=f'рецепт {number}', text='описание',
+            cooking_time=5, image='recipes/images/test.png'
+        ) for number in range(2)]
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, query):
+        response = APIClient().get('/api/recipes/', query)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()]
+
+    def test_ordering_by_favorites_count(self):
+        query = {'ordering': '-favorites_count,-pub_date'}
+        first, second = self.recipes
+        self.assertEqual(self.get_ids(query), [second.id, first.id])
+        self.assertEqual(self.get_ids({}), [second.id, first.id])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/recipes/{first.id}/favorite/')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get_ids(query), [first.id, second.id])
+        self.assertEqual(self.get_ids({}), [second.id, first.id])
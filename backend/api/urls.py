@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from djoser.views import TokenCreateView, TokenDestroyView
 
-from .views import (TagViewSet, IngredientViewSet, UserViewSet, RecipeViewSet)
+from .views import (TagViewSet, IngredientViewSet, UserViewSet, RecipeViewSet,
+                    metrics)
 
 app_name = 'api'
 
@@ -25,4 +26,5 @@ urlpatterns = [
     path(r'recipes/', include(recipes_router_v1.urls)),
     path(r'ingredients/', include(ingredients_router_v1.urls)),
     path(r'tags/', include(tags_router_v1.urls)),
+    path(r'metrics/', metrics, name='metrics'),
 ]
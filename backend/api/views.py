@@ -1,32 +1,106 @@
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, exceptions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
+from core.metrics import render_metrics
 from core.models import Tag, Ingredient
 from core.permissions import UserPermission, RecipePermission
+from core.feed import get_feed, subscriptions_changed
 from core.filters import RecipeFilter, IngredientFilter
-from core.pagination import FoodgramPagination
-from recipes.models import Recipe, IngredientInRecipe, Favorite, ShoppingCart
+from core.pagination import FoodgramPagination, RankedPagination
+from core.recipe_index import recipe_index
+from core.shopping_list import (SHOPPING_LIST_FORMATS, get_shopping_list,
+                                spool)
+from recipes.models import Recipe, Favorite, ShoppingCart
 from users.models import User, Subscribe
-from .mixins import ListRetrieveCreateViewSet
+from .async_views import AsyncViewSetMixin
+from .mixins import (AnonymousCacheMixin, BatchRelationMixin,
+                     ConditionalGetMixin, FieldSelectionMixin,
+                     ListRetrieveCreateViewSet, ReplicaReadMixin,
+                     lock_owner)
 from .serializers import (TagSerializer, IngredientSerializer, UserSerializer,
                           CreateUserSerializer, SetPasswordSerializer,
                           RecipeSerializer, CreateRecipeSerializer,
-                          AddRecipeSerializer, AddUserSerializer)
-
-
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+                          AddRecipeSerializer, AddUserSerializer,
+                          AvailableIngredientsSerializer)
+
+
+def get_recipes_limit(request):
+    """Возвращает ограничение количества рецептов автора из параметра
+    recipes_limit или None, если параметр не передан"""
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None:
+        return None
+
+    if not recipes_limit.isdigit() or int(recipes_limit) < 1:
+        raise exceptions.ValidationError(
+            'recipes_limit должен быть положительным числом')
+
+    return int(recipes_limit)
+
+
+def get_recipes(user, selection):
+    """Рецепты с данными для выбранных полей ответа: связи, признаки
+    и описание, которых нет в ответе, не подгружаются"""
+    author = selection.expands('author')
+    flags = [flag for flag in ('is_favorited', 'is_in_shopping_cart')
+             if selection.includes(flag)]
+    if author and selection.nested('author').includes('is_subscribed'):
+        flags.append('is_subscribed')
+    recipes = Recipe.objects.with_related(
+        author=author,
+        tags=selection.includes('tags'),
+        ingredients=selection.includes('ingredients')
+    ).with_user_flags(user, flags)
+    if not selection.includes('text'):
+        recipes = recipes.defer('text')
+    return recipes
+
+
+def get_subscriptions(user, recipes_limit, selection):
+    """Авторы, на которых подписан пользователь, с последними рецептами,
+    упорядоченные от последней подписки. Рецепты подгружаются, только
+    если они есть в ответе"""
+    authors = User.objects.filter(
+        authors__subscriber=user
+    ).annotate(
+        subscription_id=F('authors__id')
+    ).order_by('-subscription_id')
+    if not selection.includes('recipes'):
+        return authors
+
+    fields = selection.nested('recipes')
+    recipes = Recipe.objects.only('author', *(
+        name for name in AddRecipeSerializer.Meta.fields
+        if fields.includes(name)))
+    if recipes_limit:
+        recipes = recipes.latest_per_author(recipes_limit)
+    return authors.prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='latest_recipes'))
+
+
+class TagViewSet(ReplicaReadMixin, AnonymousCacheMixin, AsyncViewSetMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тегов, разрешает только безопасные запросы"""
+    async_actions = ('list', 'retrieve')
+    cache_generations = ('tags',)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, AnonymousCacheMixin,
+                        AsyncViewSetMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для ингредиентов, разрешает только безопасные запросы"""
+    async_actions = ('list', 'retrieve')
+    cache_generations = ('ingredients',)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
@@ -34,11 +108,14 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ('^name',)
 
 
-class UserViewSet(ListRetrieveCreateViewSet):
+class UserViewSet(ReplicaReadMixin, FieldSelectionMixin, BatchRelationMixin,
+                  AsyncViewSetMixin, ListRetrieveCreateViewSet):
     """Вьюсет для пользователей, разрешает GET и POST запросы"""
+    async_actions = ('me', 'subscriptions')
     queryset = User.objects.all()
     permission_classes = (UserPermission,)
     pagination_class = FoodgramPagination
+    keyset_ordering = None
 
     def get_serializer_class(self):
         """Указывает какой сериализатор используется
@@ -55,16 +132,21 @@ class UserViewSet(ListRetrieveCreateViewSet):
         username = serializer.validated_data.get('username')
         user = self.queryset.get(username=username)
         user.set_password(serializer.validated_data.get('password'))
-        user.save()
+        user.save(update_fields=['password'])
         return Response(serializer.data)
 
     @action(methods=['get'], detail=False,
             permission_classes=(IsAuthenticated,))
     def me(self, request):
         """Возвращает информацию об авторе запроса"""
+        # подписаться на самого себя нельзя
+        request.user.is_subscribed = False
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
 
+    async def ame(self, request):
+        return self.me(request)
+
     @action(methods=['post'], detail=False,
             serializer_class=SetPasswordSerializer,
             permission_classes=(IsAuthenticated,))
@@ -82,10 +164,10 @@ class UserViewSet(ListRetrieveCreateViewSet):
             raise exceptions.ValidationError(
                 'Новый пароль должен отличаться от старого')
 
+        # пользователь запроса может быть копией из кэша аутентификации
         user.set_password(serializer.validated_data.get('new_password'))
-        user.save()
-        return Response('Пароль успешно изменен',
-                        status=status.HTTP_204_NO_CONTENT)
+        user.save(update_fields=['password'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['post', 'delete'], detail=True,
             serializer_class=AddUserSerializer,
@@ -97,31 +179,47 @@ class UserViewSet(ListRetrieveCreateViewSet):
             return Response('Нельзя подписаться на самого себя',
                             status=status.HTTP_400_BAD_REQUEST)
 
-        subscribe = Subscribe.objects.filter(subscriber=request.user,
-                                             author=author)
-        if request.method == 'DELETE':
-            if not subscribe:
-                return Response('Вы не подписаны на этого пользователя',
-                                status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            lock_owner(request.user)
+            subscribe = Subscribe.objects.filter(subscriber=request.user,
+                                                 author=author)
+            if request.method == 'DELETE':
+                if not subscribe:
+                    return Response('Вы не подписаны на этого пользователя',
+                                    status=status.HTTP_400_BAD_REQUEST)
 
-            subscribe.delete()
-            return Response('Вы успешно отписались от пользователя',
-                            status=status.HTTP_204_NO_CONTENT)
+                subscribe.delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
 
-        if subscribe:
-            return Response('Вы уже подписаны на этого пользователя',
-                            status=status.HTTP_400_BAD_REQUEST)
+            if subscribe:
+                return Response('Вы уже подписаны на этого пользователя',
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        Subscribe.objects.create(subscriber=request.user, author=author)
+            Subscribe.objects.create(subscriber=request.user, author=author)
         serializer = self.get_serializer(author)
         return Response(serializer.data)
 
-    @action(methods=['get'], detail=False, serializer_class=AddUserSerializer,
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='subscribe/batch',
             permission_classes=(IsAuthenticated,))
+    def subscribe_batch(self, request):
+        """Подписывается на несколько пользователей или отписывается
+        от них одним запросом"""
+        return self.batch_relation(
+            request, Subscribe, 'subscriber', 'author_id',
+            User.objects.all(), counter=(User, 'followers_count'),
+            excluded={request.user.id},
+            on_change=lambda authors, delta: subscriptions_changed(
+                request.user.id, authors, delta)
+        )
+
+    @action(methods=['get'], detail=False, serializer_class=AddUserSerializer,
+            permission_classes=(IsAuthenticated,),
+            keyset_ordering=('-subscription_id',))
     def subscriptions(self, request):
         """Возвращает всех пользователей, на которых подписан автор запроса"""
-        subscriptions = request.user.subscribers.all()
-        authors = [sub.author for sub in subscriptions]
+        authors = get_subscriptions(request.user, get_recipes_limit(request),
+                                    self.get_field_selection())
         page = self.paginate_queryset(authors)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -130,16 +228,39 @@ class UserViewSet(ListRetrieveCreateViewSet):
         serializer = self.get_serializer(authors, many=True)
         return Response(serializer.data)
 
+    async def asubscriptions(self, request):
+        authors = get_subscriptions(request.user, get_recipes_limit(request),
+                                    self.get_field_selection())
+        return await self.apaginated_response(authors)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = get_recipes_limit(self.request)
+        return context
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, ConditionalGetMixin,
+                    AnonymousCacheMixin, FieldSelectionMixin,
+                    BatchRelationMixin, AsyncViewSetMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для рецептов, разрешает все виды запросов"""
+    async_actions = ('list', 'retrieve')
+    cache_generations = ('recipes', 'tags', 'ingredients', 'users')
+    ordering_generations = {'favorites_count': 'favorites'}
     queryset = Recipe.objects.all()
     permission_classes = (RecipePermission,)
     pagination_class = FoodgramPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    keyset_ordering = ('-pub_date', '-id')
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    def get_queryset(self):
+        """Подгружает связанные данные и признаки для автора запроса,
+        которые нужны полям ответа, чтобы страница рецептов собиралась
+        фиксированным числом запросов"""
+        return get_recipes(self.request.user, self.get_field_selection())
+
     def get_serializer_class(self):
         """Указывает какой сериализатор используется
         в зависимости от типа запроса"""
@@ -148,27 +269,41 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return self.serializer_class or RecipeSerializer
 
+    def get_paginated_response(self, data):
+        """Поиск ранжирует не более RECIPE_SEARCH_MAX_RESULTS последних
+        подходящих рецептов. Если их количество достигло этого предела,
+        признак truncated сообщает, что подходящих рецептов может быть
+        больше, чем в ответе"""
+        response = super().get_paginated_response(data)
+        if (self.action == 'list' and 'count' in response.data
+                and self.request.query_params.get('search')):
+            response.data['truncated'] = (
+                response.data['count'] >= settings.RECIPE_SEARCH_MAX_RESULTS)
+        return response
+
     @action(methods=['post', 'delete'], detail=True,
             serializer_class=AddRecipeSerializer,
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, pk):
         """Добавляет рецепт в избранное или убирает из него"""
         recipe = self.queryset.get(id=pk)
-        favorite = Favorite.objects.filter(user=request.user, recipe=recipe)
-        if request.method == 'DELETE':
-            if not favorite:
-                return Response('В избранном данного рецепта нет',
+        with transaction.atomic():
+            lock_owner(request.user)
+            favorite = Favorite.objects.filter(user=request.user,
+                                               recipe=recipe)
+            if request.method == 'DELETE':
+                if not favorite:
+                    return Response('В избранном данного рецепта нет',
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                favorite.delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            if favorite:
+                return Response('Рецепт уже добавлен в избранное',
                                 status=status.HTTP_400_BAD_REQUEST)
 
-            favorite.delete()
-            return Response('Рецепт успешно удален из избранного',
-                            status=status.HTTP_204_NO_CONTENT)
-
-        if favorite:
-            return Response('Рецепт уже добавлен в избранное',
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        Favorite.objects.create(user=request.user, recipe=recipe)
+            Favorite.objects.create(user=request.user, recipe=recipe)
         serializer = self.get_serializer(recipe)
         return Response(serializer.data)
 
@@ -178,57 +313,119 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, pk):
         """Добавляет рецепт в список покупок или убирает из него"""
         recipe = self.queryset.get(id=pk)
-        shopping_cart = ShoppingCart.objects.filter(
-            user=request.user,
-            recipe=recipe
-        )
-        if request.method == 'DELETE':
-            if not shopping_cart:
-                return Response('В списке покупок данного рецепта нет',
+        with transaction.atomic():
+            lock_owner(request.user)
+            shopping_cart = ShoppingCart.objects.filter(
+                user=request.user,
+                recipe=recipe
+            )
+            if request.method == 'DELETE':
+                if not shopping_cart:
+                    return Response('В списке покупок данного рецепта нет',
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                shopping_cart.delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            if shopping_cart:
+                return Response('Рецепт уже добавлен в список покупок',
                                 status=status.HTTP_400_BAD_REQUEST)
 
-            shopping_cart.delete()
-            return Response('Рецепт успешно удален из списка покупок',
-                            status=status.HTTP_204_NO_CONTENT)
-
-        if shopping_cart:
-            return Response('Рецепт уже добавлен в список покупок',
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        ShoppingCart.objects.create(user=request.user, recipe=recipe)
+            ShoppingCart.objects.create(user=request.user, recipe=recipe)
         serializer = self.get_serializer(recipe)
         return Response(serializer.data)
 
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,),
+            keyset_ordering=('-pub_date', '-recipe_id'))
+    def feed(self, request):
+        """Возвращает рецепты авторов, на которых подписан автор запроса,
+        от новых к старым, страницами по курсору"""
+        entries = self.paginator.paginate_merged(
+            get_feed(request.user), request, self)
+        ids = [entry.recipe_id for entry in entries]
+        recipes = self.get_queryset().in_bulk(ids)
+        page = [recipes[recipe_id] for recipe_id in ids
+                if recipe_id in recipes]
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=False, url_path='by_ingredients',
+            pagination_class=RankedPagination)
+    def by_ingredients(self, request):
+        """Подбирает рецепты по имеющимся ингредиентам: первыми идут
+        рецепты, для которых не хватает меньше всего ингредиентов"""
+        serializer = AvailableIngredientsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ranked = recipe_index.search(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data.get('max_missing'))
+        ids = self.paginate_queryset(ranked)
+        recipes = self.get_queryset().in_bulk(ids)
+        # рецепт из индекса основной базы может еще не дойти до реплики
+        page = [recipes[recipe_id] for recipe_id in ids
+                if recipe_id in recipes]
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='favorite/batch',
+            permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        """Добавляет несколько рецептов в избранное или убирает их
+        из него одним запросом"""
+        return self.batch_relation(
+            request, Favorite, 'user', 'recipe_id', Recipe.objects.all(),
+            counter=(Recipe, 'favorites_count'), generations=('favorites',)
+        )
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart/batch',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        """Добавляет несколько рецептов в список покупок или убирает их
+        из него одним запросом"""
+        return self.batch_relation(
+            request, ShoppingCart, 'user', 'recipe_id', Recipe.objects.all())
+
+    @action(methods=['delete'], detail=False, url_path='shopping_cart',
+            permission_classes=(IsAuthenticated,))
+    def clear_shopping_cart(self, request):
+        """Очищает список покупок"""
+        request.user.shopping_cart.all().delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(methods=['get'], detail=False,
             permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        """Отдает пользователю список ингредиентов из его списка покупок,
-        и необходимое их количество, файлом в формате .txt"""
-        def add_ingredient_in_ingredient_list(
-                ingredient_in_recipe: IngredientInRecipe) -> None:
-            """Добавляет ингредиент в список покупок,
-            суммирует количество по одинаковым ингредиентам"""
-            ingredient_name = ingredient_in_recipe.ingredient.name
-            measurement_unit = ingredient_in_recipe.ingredient.measurement_unit
-            amount = ingredient_in_recipe.amount
-            ingredient = f'{ingredient_name} ({measurement_unit})'
-            if ingredient in ingredients_list:
-                ingredients_list[ingredient] += amount
-            else:
-                ingredients_list[ingredient] = amount
-            return None
-
-        ingredients_list = {}
-        recipes_in_shopping_cart = request.user.shopping_cart.all()
-        for recipe in recipes_in_shopping_cart:
-            ingredients_in_recipe = recipe.recipe.ingredients_in_recipes.all()
-            [add_ingredient_in_ingredient_list(ingredient_in_recipe)
-             for ingredient_in_recipe in ingredients_in_recipe]
-
-        filename = 'test.txt'
-        data = [f'{item} - {ingredients_list[item]}\n'
-                for item in ingredients_list]
-        response = HttpResponse(data, content_type='text/plain; charset=UTF-8')
+        """Отдает пользователю список ингредиентов из его списка покупок
+        и необходимое их количество файлом в формате txt, csv или json"""
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response('Неподдерживаемый формат файла',
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+        content = render(get_shopping_list(request.user).iterator())
+        filename = 'shopping_list_{0}.{1}'.format(
+            timezone.localdate().isoformat(), file_format)
+        if settings.ASYNC_READ_VIEWS:
+            # под ASGI потоковый ответ читается в цикле событий, где
+            # запросы к базе данных запрещены, поэтому строки читаются
+            # здесь во временный файл, а ответ отдается из него
+            response = FileResponse(spool(content), filename=filename,
+                                    content_type=content_type)
+        else:
+            response = StreamingHttpResponse(content,
+                                             content_type=content_type)
         response['Content-Disposition'] = (
             'attachment; filename={0}'.format(filename))
         return response
+
+
+def metrics(request):
+    """Отдает метрики производительности в формате Prometheus"""
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.CompressionMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,17 +84,98 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='qweasd321'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default=5432)
+        'PORT': os.getenv('DB_PORT', default=5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплики для чтения перечисляются через запятую в DB_REPLICAS: адреса
+# host[:port] для PostgreSQL или пути к файлам для SQLite. Безопасные
+# запросы к вьюсетам читают из реплик, после записи пользователь на время
+# REPLICA_PIN_SECONDS читает из основной базы, чтобы видеть свои изменения
+
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if 'sqlite3' in replica['ENGINE']:
+        replica['NAME'] = address.strip()
+    else:
+        host, _, port = address.strip().partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    DATABASES[f'replica_{number}'] = replica
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
+# Cache
+# Поколения данных (каталог ингредиентов, кэш ответов, учетные данные
+# пользователей) хранятся в кэше, при нескольких процессах gunicorn кэш
+# должен быть общим (например, FileBasedCache или RedisCache), иначе
+# проверка core.E001 завершается ошибкой
+
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', default=1))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+# Кэш ответов для анонимных GET запросов к спискам рецептов, тегов
+# и ингредиентов, сбрасывается сменой поколения при изменении данных
+
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+# Сжатие ответов JSON от MIN_SIZE байт: brotli с качеством BROTLI_QUALITY,
+# если установлен пакет Brotli и клиент его принимает, иначе gzip с уровнем
+# GZIP_LEVEL. Небольшие ответы не сжимаются, сжатие не окупается
+
+RESPONSE_COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+}
+
+# ASGI
+# При SERVER_MODE=asgi (gunicorn с воркерами uvicorn) GET запросы к спискам
+# и карточкам рецептов, ингредиентам, тегам, users/me и подпискам
+# обслуживают асинхронные вьюхи, остальные запросы - вьюсеты DRF.
+# Независимые запросы к базе данных (страница и количество объектов)
+# выполняются одновременно в отдельных соединениях
+
+ASYNC_READ_VIEWS = os.getenv('SERVER_MODE', default='sync') == 'asgi'
+ASYNC_PARALLEL_QUERIES = True
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'core.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly'
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Пользователи токенов запоминаются в памяти процесса на TIMEOUT секунд,
+# не более MAX_SIZE токенов. Выход, смена пароля и деактивация сбрасывают
+# запись во всех процессах через поколение в общем кэше
+
+TOKEN_AUTHENTICATION_CACHE = {
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 300,
 }
 
 DJOSER = {
@@ -139,6 +222,50 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Recipe images
+# Загруженные изображения проверяются до декодирования, затем в фоновом
+# потоке перекодируются с ограничением большей стороны по полям модели
+
+RECIPE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+RECIPE_IMAGE_MAX_PIXELS = 40_000_000
+RECIPE_IMAGE_SIZES = {
+    'image': 1920,
+    'image_medium': 640,
+    'image_small': 320,
+}
+RECIPE_IMAGE_QUALITY = 80
+RECIPE_IMAGE_WORKERS = 2
+RECIPE_IMAGE_PROCESSING_ASYNC = True
+
+# Recipe search
+# Полнотекстовый поиск ранжирует по ts_rank не более указанного
+# количества последних рецептов, подходящих под запрос
+
+RECIPE_SEARCH_MAX_RESULTS = 1000
+
+# Подбор рецептов по имеющимся ингредиентам
+# Обратный индекс ингредиентов в памяти процесса догоняет журнал
+# изменений рецептов в кэше. Если изменений больше MAX_CHANGES или запись
+# журнала отсутствует дольше GAP_TIMEOUT секунд, индекс строится заново
+
+RECIPE_INGREDIENT_INDEX = {
+    'JOURNAL_TIMEOUT': 24 * 60 * 60,
+    'MAX_CHANGES': 1000,
+    'GAP_TIMEOUT': 5,
+}
+
+# Лента подписок
+# Рецепты авторов, у которых не больше FAN_OUT_LIMIT подписчиков,
+# при публикации раскладываются по лентам подписчиков, рецепты более
+# популярных авторов лента читает при запросе. При подписке в ленту
+# добавляются BACKFILL последних рецептов автора
+
+RECIPE_FEED = {
+    'FAN_OUT_LIMIT': 1000,
+    'BACKFILL': 100,
+    'BATCH_SIZE': 1000,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
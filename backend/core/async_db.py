@@ -0,0 +1,37 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from core.metrics import current_metrics
+
+
+def run_in_own_connection(function, metrics):
+    """Выполняет функцию в потоке пула с собственным соединением
+    и учитывает её запросы в метриках запроса"""
+    try:
+        if metrics is None:
+            return function()
+
+        with connection.execute_wrapper(metrics):
+            return function()
+    finally:
+        close_old_connections()
+
+
+async def gather_queries(*functions):
+    """Выполняет независимые синхронные функции с запросами к базе данных
+    одновременно, каждую в своем потоке и соединении, и возвращает список
+    их результатов. Асинхронный ORM выполняет запросы одного запроса
+    по очереди в общем потоке, так же они выполняются при выключенной
+    настройке ASYNC_PARALLEL_QUERIES"""
+    if not settings.ASYNC_PARALLEL_QUERIES:
+        return [await sync_to_async(function)() for function in functions]
+
+    metrics = current_metrics.get()
+    return await asyncio.gather(*(
+        sync_to_async(run_in_own_connection, thread_sensitive=False)(
+            function, metrics)
+        for function in functions
+    ))
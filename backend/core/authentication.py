@@ -0,0 +1,128 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+
+from core.cache import aget_generation, get_generation
+
+
+def credentials_generation(user_id):
+    """Имя поколения учетных данных пользователя. Поколение меняется
+    при выходе, смене пароля и деактивации пользователя"""
+    return f'credentials:{user_id}'
+
+
+class TokenCache:
+    """Ограниченный LRU кэш пользователей по ключу токена в памяти
+    процесса. Запись устаревает через TIMEOUT секунд и при смене
+    поколения учетных данных пользователя"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Возвращает пользователя, токен и поколение или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def set(self, key, user, token, generation):
+        options = settings.TOKEN_AUTHENTICATION_CACHE
+        with self._lock:
+            self._entries[key] = (time.monotonic() + options['TIMEOUT'],
+                                  user, token, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > options['MAX_SIZE']:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """Аутентификация по токену с асинхронным вариантом для асинхронных
+    вьюх, проверка токена общая для обоих вариантов"""
+    async def aauthenticate(self, request):
+        """Асинхронный вариант authenticate"""
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. No credentials provided.'))
+        elif len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain spaces.'))
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain invalid characters.'))
+
+        return await self.aauthenticate_credentials(token)
+
+    async def aauthenticate_credentials(self, key):
+        return await sync_to_async(self.authenticate_credentials)(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену, которая запоминает пользователя токена
+    в памяти процесса и не обращается к базе данных на каждый запрос.
+    Запись проверяется по поколению учетных данных в кэше, поэтому выход,
+    смена пароля и деактивация действуют сразу во всех процессах,
+    которые используют общий кэш. Кэш в памяти процесса при нескольких
+    воркерах gunicorn запрещает проверка core.E001"""
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token, generation = cached
+            if get_generation(credentials_generation(user.id)) == generation:
+                return copy.copy(user), token
+
+        return self.load_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token, generation = cached
+            if await aget_generation(
+                    credentials_generation(user.id)) == generation:
+                return copy.copy(user), token
+
+        return await sync_to_async(self.load_credentials)(key)
+
+    def load_credentials(self, key):
+        """Проверяет токен по базе данных и запоминает пользователя.
+        Поколение читается до запроса, чтобы выход во время запроса
+        не оставил в кэше удаленный токен"""
+        try:
+            user_id = self.get_model().objects.values_list(
+                'user_id', flat=True).get(key=key)
+        except self.get_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        generation = get_generation(credentials_generation(user_id))
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token, generation)
+        return copy.copy(user), token
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE['ALIAS']]
+
+
+def get_generation(name):
+    """Возвращает текущее поколение данных name, общее для всех процессов"""
+    cache = get_cache()
+    key = f'generation:{name}'
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+async def aget_generation(name):
+    """Асинхронный вариант get_generation"""
+    cache = get_cache()
+    key = f'generation:{name}'
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, uuid.uuid4().hex, None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def bump_generation(*names):
+    """Начинает новое поколение данных, ранее закэшированные значения
+    этих данных больше не используются. Время смены поколения
+    запоминается для заголовка Last-Modified"""
+    changed_at = time.time()
+    values = {}
+    for name in names:
+        values[f'generation:{name}'] = uuid.uuid4().hex
+        values[f'changed_at:{name}'] = changed_at
+    get_cache().set_many(values, None)
+
+
+def get_changed_at(*names):
+    """Возвращает время последней смены поколений данных names
+    в секундах. Неизвестное время считается текущим"""
+    cache = get_cache()
+    keys = [f'changed_at:{name}' for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            now = time.time()
+            cache.add(key, now, None)
+            values[key] = cache.get(key, now)
+    return max(values.values())
+
+
+def normalize_params(params):
+    """Параметры запроса без пустых значений, порядок параметров и их
+    значений не важен"""
+    return sorted(
+        (name, sorted(value for value in params.getlist(name) if value))
+        for name in params
+    )
+
+
+def make_key(prefix, generations, params):
+    """Строит ключ кэша из поколений данных и нормализованных
+    параметров запроса, порядок параметров и их значений не важен"""
+    normalized = normalize_params(params)
+    versions = ':'.join(get_generation(name) for name in generations)
+    digest = hashlib.md5(
+        f'{versions}:{normalized}'.encode(), usedforsecurity=False
+    ).hexdigest()
+    return f'response:{prefix}:{digest}'
+
+
+def get_or_build(key, build):
+    """Возвращает значение из кэша или строит его. Промах кэша под
+    нагрузкой строит значение один раз: остальные запросы ждут его
+    появления в кэше, пока строящий держит блокировку"""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_timeout = settings.RESPONSE_CACHE['LOCK_TIMEOUT']
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, lock_timeout):
+        try:
+            value = build()
+            cache.set(key, value, settings.RESPONSE_CACHE['TIMEOUT'])
+        finally:
+            cache.delete(lock)
+        return value
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(settings.RESPONSE_CACHE['POLL_INTERVAL'])
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        if cache.get(lock) is None:
+            break
+    return build()
+
+
+async def aget_or_build(key, build):
+    """Асинхронный вариант get_or_build, build - корутинная функция"""
+    cache = get_cache()
+    value = await cache.aget(key)
+    if value is not None:
+        return value
+
+    lock_timeout = settings.RESPONSE_CACHE['LOCK_TIMEOUT']
+    lock = f'{key}:lock'
+    if await cache.aadd(lock, 1, lock_timeout):
+        try:
+            value = await build()
+            await cache.aset(key, value, settings.RESPONSE_CACHE['TIMEOUT'])
+        finally:
+            await cache.adelete(lock)
+        return value
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.RESPONSE_CACHE['POLL_INTERVAL'])
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+
+        if await cache.aget(lock) is None:
+            break
+    return await build()
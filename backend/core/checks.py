@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    """Поколения данных, учетных данных и журнал индекса ингредиентов
+    хранятся в кэше. Кэш в памяти процесса при нескольких воркерах
+    gunicorn оставил бы в других процессах устаревшие ответы и токены"""
+    alias = settings.RESPONSE_CACHE['ALIAS']
+    backend = settings.CACHES[alias]['BACKEND']
+    if settings.GUNICORN_WORKERS > 1 and backend in LOCAL_CACHES:
+        return [Error(
+            f'Кэш {alias!r} ({backend}) хранится в памяти процесса, '
+            f'а воркеров gunicorn {settings.GUNICORN_WORKERS}.',
+            hint='Задайте общий кэш переменными CACHE_BACKEND и '
+                 'CACHE_LOCATION, например, RedisCache или '
+                 'FileBasedCache.',
+            id='core.E001',
+        )]
+    return []
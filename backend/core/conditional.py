@@ -0,0 +1,137 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from core.cache import (bump_generation, get_changed_at, get_generation,
+                        normalize_params)
+from core.db_router import primary_reads
+
+
+def relations_generation(user_id):
+    """Имя поколения связей пользователя с рецептами и авторами:
+    избранного, списка покупок и подписок"""
+    return f'relations:{user_id}'
+
+
+def relations_changed(user_id, *names):
+    """Меняет поколение связей пользователя и поколения names после
+    фиксации транзакции"""
+    transaction.on_commit(lambda: bump_generation(
+        relations_generation(user_id), *names))
+
+
+def get_generations(request, generations):
+    """Поколения данных ответа: общие generations и, для автора запроса,
+    его связи, от которых зависят признаки избранного, списка покупок
+    и подписки"""
+    if request.user.is_authenticated:
+        generations = (*generations, relations_generation(request.user.id))
+    return generations
+
+
+def make_etag(request, media_type, versions):
+    """Слабый ETag из адреса, параметров запроса, формата ответа,
+    автора запроса и версий данных. Слабый, потому что сжатие меняет
+    байты ответа, но не его смысл"""
+    digest = hashlib.md5(':'.join((
+        request.build_absolute_uri(request.path),
+        str(normalize_params(request.GET)),
+        media_type or '',
+        str(request.user.id),
+        *versions
+    )).encode(), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+def get_ordering_generations(params, ordering_generations):
+    """Поколения полей, по которым параметр ordering сортирует список.
+    ordering_generations сопоставляет полю поколение его значений"""
+    ordering = params.get('ordering', '')
+    return tuple(name for field, name in (ordering_generations or {}).items()
+                 if field in ordering)
+
+
+def list_validators(request, media_type, generations,
+                    ordering_generations=None):
+    """ETag и время изменения списка по поколениям данных, без запросов
+    к базе данных. Максимум дат изменения отобранных рецептов не заметил
+    бы удаленные рецепты и рецепты, которые перестали подходить
+    под фильтры, поэтому используется время смены поколений.
+    ordering_generations добавляет поколения полей сортировки"""
+    generations = get_generations(request, (
+        *generations,
+        *get_ordering_generations(request.GET, ordering_generations)))
+    etag = make_etag(request, media_type,
+                     [get_generation(name) for name in generations])
+    return etag, get_changed_at(*generations)
+
+
+def detail_validators(request, media_type, updated_at, generations=()):
+    """ETag и время изменения объекта по его дате изменения updated_at
+    и поколениям данных"""
+    generations = get_generations(request, generations)
+    etag = make_etag(request, media_type, [
+        updated_at.isoformat(),
+        *(get_generation(name) for name in generations)
+    ])
+    last_modified = updated_at.timestamp()
+    if generations:
+        last_modified = max(last_modified, get_changed_at(*generations))
+    return etag, last_modified
+
+
+def not_modified(request, validators):
+    """Ответ 304 (или 412 для If-Match), если у клиента актуальная
+    версия ответа, иначе None"""
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        set_validators(response, validators)
+    return response
+
+
+def set_validators(response, validators):
+    """Добавляет успешному ответу заголовки ETag и Last-Modified"""
+    if response.status_code in (200, 304):
+        etag, last_modified = validators
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(int(last_modified))
+    return response
+
+
+def is_recent(validators):
+    """Данные изменились недавно и могли еще не дойти до реплик. Такой
+    ответ строится по основной базе, иначе устаревший ответ реплики
+    получит ETag новых данных"""
+    return time.time() - validators[1] < settings.REPLICA_PIN_SECONDS
+
+
+def conditional_response(request, validators, build):
+    """Отвечает 304, если у клиента актуальная версия ответа, иначе
+    строит ответ функцией build и добавляет к нему ETag и Last-Modified"""
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+
+    if is_recent(validators):
+        with primary_reads():
+            return set_validators(build(), validators)
+    return set_validators(build(), validators)
+
+
+async def aconditional_response(request, validators, build):
+    """Асинхронный вариант conditional_response, build - корутинная
+    функция"""
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+
+    if is_recent(validators):
+        with primary_reads():
+            return set_validators(await build(), validators)
+    return set_validators(await build(), validators)
@@ -0,0 +1,68 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+suspended = ContextVar('counters_suspended', default=False)
+
+
+class CounterFieldsMixin:
+    """Сохранение существующего объекта без update_fields не записывает
+    поля-счетчики counter_fields: они меняются запросами в обход модели,
+    и значения в памяти (например, пользователя из кэша аутентификации)
+    могут быть устаревшими"""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None and not args):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+@contextmanager
+def suspend_counters():
+    """Отключает обновление счетчиков сигналами, вызывающий код
+    обновляет их сам одним запросом через change_counter"""
+    token = suspended.set(True)
+    try:
+        yield
+    finally:
+        suspended.reset(token)
+
+
+def change_counter(model, field, ids, delta=1):
+    """Изменяет счетчик field объектов model на delta за каждое
+    вхождение id, одним запросом на каждое итоговое изменение"""
+    grouped = defaultdict(list)
+    for object_id, times in Counter(ids).items():
+        grouped[times * delta].append(object_id)
+    for change, object_ids in grouped.items():
+        model.objects.filter(id__in=object_ids).update(
+            **{field: F(field) + change})
+
+
+def recount(queryset, field, related_model, related_field, batch_size=1000):
+    """Пересчитывает счетчик field по связанной модели пачками по id,
+    возвращает количество обработанных объектов"""
+    counts = related_model.objects.filter(
+        **{related_field: OuterRef('pk')}
+    ).order_by().values(related_field).annotate(
+        total=Count('pk')
+    ).values('total')
+    ids = queryset.order_by('id').values_list('id', flat=True)
+    processed, last_id = 0, 0
+    while batch := list(ids.filter(id__gt=last_id)[:batch_size]):
+        queryset.model.objects.filter(id__in=batch).update(
+            **{field: Coalesce(Subquery(counts), 0)})
+        processed += len(batch)
+        last_id = batch[-1]
+    return processed
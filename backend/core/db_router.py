@@ -0,0 +1,66 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from core.cache import get_cache
+
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES
+            if alias != DEFAULT_DB_ALIAS]
+
+
+@contextmanager
+def primary_reads():
+    """Направляет чтение внутри блока в основную базу данных"""
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+def pin_key(user):
+    return f'primary_pin:{user.id}'
+
+
+def pin_to_primary(user):
+    """Закрепляет чтение пользователя за основной базой данных, пока
+    реплики не получат его изменения"""
+    if user.is_authenticated:
+        get_cache().set(pin_key(user), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return (user.is_authenticated
+            and get_cache().get(pin_key(user)) is not None)
+
+
+async def ais_pinned(user):
+    return (user.is_authenticated
+            and await get_cache().aget(pin_key(user)) is not None)
+
+
+class PrimaryReplicaRouter:
+    """Запись и миграции выполняются в основной базе данных, чтение -
+    в случайной реплике, если его разрешил вьюсет безопасного запроса"""
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and replica_reads.get():
+            return random.choice(replicas)
+
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from recipes.models import FeedEntry, Recipe
+from users.models import Subscribe, User
+
+
+def fan_out_limit():
+    return settings.RECIPE_FEED['FAN_OUT_LIMIT']
+
+
+def add_entries(rows):
+    """Добавляет записи ленты из пар (подписчик, рецепт), рецепт
+    передается кортежем (id, id автора, дата публикации)"""
+    FeedEntry.objects.bulk_create((
+        FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                  author_id=author_id, pub_date=pub_date)
+        for user_id, (recipe_id, author_id, pub_date) in rows
+    ), batch_size=settings.RECIPE_FEED['BATCH_SIZE'], ignore_conflicts=True)
+
+
+def fan_out(recipe):
+    """Раскладывает опубликованный рецепт по лентам подписчиков автора.
+    Рецепты популярных авторов не раскладываются, лента читает их
+    при запросе"""
+    if User.objects.filter(id=recipe.author_id,
+                           followers_count__gt=fan_out_limit()).exists():
+        return
+
+    subscribers = Subscribe.objects.filter(
+        author_id=recipe.author_id).values_list('subscriber_id', flat=True)
+    values = (recipe.id, recipe.author_id, recipe.pub_date)
+    add_entries((subscriber, values) for subscriber in subscribers)
+
+
+def backfill(subscriber_id, author_ids):
+    """Добавляет в ленту подписчика последние рецепты новых авторов"""
+    authors = User.objects.filter(
+        id__in=author_ids, followers_count__lte=fan_out_limit())
+    recipes = Recipe.objects.filter(author__in=authors).latest_per_author(
+        settings.RECIPE_FEED['BACKFILL']
+    ).values_list('id', 'author_id', 'pub_date')
+    add_entries((subscriber_id, values) for values in recipes)
+
+
+def subscriptions_changed(subscriber_id, author_ids, delta):
+    """Дополняет ленту после подписки на авторов или очищает ее после
+    отписки. Дополнение выполняется после фиксации транзакции"""
+    if delta > 0:
+        transaction.on_commit(lambda: backfill(subscriber_id, author_ids))
+    else:
+        FeedEntry.objects.filter(
+            user_id=subscriber_id, author_id__in=author_ids).delete()
+
+
+def get_feed(user):
+    """Возвращает источники ленты пользователя с общим ключом
+    (pub_date, recipe_id): записи ленты и рецепты популярных авторов,
+    на которых он подписан"""
+    popular = Subscribe.objects.filter(
+        subscriber=user, author__followers_count__gt=fan_out_limit()
+    ).values('author_id')
+    return (
+        FeedEntry.objects.filter(user=user).exclude(
+            author_id__in=popular).only('recipe_id', 'pub_date'),
+        Recipe.objects.filter(author_id__in=popular).annotate(
+            recipe_id=F('id')).only('id', 'pub_date'),
+    )
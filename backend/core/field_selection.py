@@ -0,0 +1,46 @@
+def parse_paths(values):
+    """Разбирает значения параметра через запятую в дерево имен полей:
+    author.username превращается в {'author': {'username': {}}}"""
+    tree = {}
+    for value in values:
+        for path in value.split(','):
+            node = tree
+            for name in path.strip().split('.'):
+                if name:
+                    node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    """Поля ответа, выбранные параметрами запроса fields и expand.
+    Без fields выводятся все поля. Поля через точку выбирают поля
+    вложенного объекта, expand выводит вложенный объект целиком вместо
+    его id"""
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand or {}
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.query_params
+        fields = parse_paths(params.getlist('fields'))
+        return cls(fields or None, parse_paths(params.getlist('expand')))
+
+    def includes(self, name):
+        return (self.fields is None or name in self.fields
+                or name in self.expand)
+
+    def expands(self, name):
+        """Выводится ли вложенный объект целиком, а не его id"""
+        return (self.fields is None or name in self.expand
+                or bool(self.fields.get(name)))
+
+    def nested(self, name):
+        """Выбор полей вложенного объекта name"""
+        fields = None if self.fields is None else self.fields.get(name)
+        return FieldSelection(fields or None, self.expand.get(name))
+
+    def unknown(self, names):
+        """Выбранные поля, которых нет среди names"""
+        return sorted((set(self.fields or ()) | set(self.expand))
+                      - set(names))
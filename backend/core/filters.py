@@ -1,7 +1,9 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as rf_filters
 from rest_framework import filters
 
-from recipes.models import Recipe
+from recipes.models import Recipe, Favorite, ShoppingCart
+from core.ingredient_index import ingredient_index
 from core.models import Tag
 
 
@@ -14,33 +16,64 @@ class RecipeFilter(rf_filters.FilterSet):
     tags = rf_filters.ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
         field_name='tags__slug',
-        to_field_name='slug'
+        to_field_name='slug',
+        method='filter_tags'
     )
+    search = rf_filters.CharFilter(label='search', method='filter_search')
+    ordering = rf_filters.OrderingFilter(
+        fields=('pub_date', 'favorites_count'))
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
 
     def filter_is_favorited(self, queryset, _, value):
         """Выводит список рецептов которые находятся или отсутствуют
         в списке избранного у пользователя"""
-        recipes_in_favorite = self.request.user.favorite.all()
-        recipes_id = [recipe.recipe.id for recipe in recipes_in_favorite]
-        if value:
-            return queryset.filter(id__in=recipes_id)
-
-        return queryset.exclude(id__in=recipes_id)
+        return self.filter_by_user_relation(queryset, Favorite, value)
 
     def filter_is_in_shopping_cart(self, queryset, _, value):
         """Выводит список рецептов которые находятся или отсутствуют
         в списке покупок у пользователя"""
-        recipes_in_shopping_cart = self.request.user.shopping_cart.all()
-        recipes_id = [recipe.recipe.id for recipe in recipes_in_shopping_cart]
+        return self.filter_by_user_relation(queryset, ShoppingCart, value)
+
+    def filter_tags(self, queryset, _, tags):
+        """Выводит рецепты с любым из тегов. Подзапрос EXISTS вместо
+        соединения не размножает рецепты и не требует DISTINCT"""
+        if not tags:
+            return queryset
+
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=tags)))
+
+    def filter_search(self, queryset, _, value):
+        """Выводит рецепты, найденные по названию и описанию,
+        в порядке релевантности"""
+        return queryset.search(value)
+
+    def filter_by_user_relation(self, queryset, model, value):
+        """Фильтрует рецепты коррелированным подзапросом EXISTS,
+        у анонимного пользователя связанных рецептов нет"""
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+
+        related = Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk')))
         if value:
-            return queryset.filter(id__in=recipes_id)
+            return queryset.filter(related)
 
-        return queryset.exclude(id__in=recipes_id)
+        return queryset.exclude(related)
 
 
 class IngredientFilter(filters.SearchFilter):
+    """Поиск ингредиентов по началу названия через индекс в памяти"""
     search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms or view.action != 'list':
+            return super().filter_queryset(request, queryset, view)
+
+        return ingredient_index.search(search_terms)
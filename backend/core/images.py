@@ -0,0 +1,109 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from core.cache import bump_generation
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',
+    b'GIF87a',
+    b'GIF89a',
+)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def has_image_signature(header):
+    """Проверяет сигнатуру файла по первым байтам"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+
+    return header.startswith(IMAGE_SIGNATURES)
+
+
+def get_output_format():
+    """Возвращает формат и расширение для сохранения изображений"""
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+
+    return 'JPEG', 'jpg'
+
+
+def render_variant(image, bound, output_format):
+    """Уменьшает изображение до заданного размера большей стороны"""
+    variant = image.copy()
+    variant.thumbnail((bound, bound))
+    buffer = BytesIO()
+    variant.save(buffer, format=output_format,
+                 quality=settings.RECIPE_IMAGE_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def process_recipe_image(recipe_id):
+    """Перекодирует изображение рецепта в ограниченный размер
+    и создает уменьшенные копии для списков рецептов"""
+    recipe = Recipe.objects.filter(id=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+
+    original_name = recipe.image.name
+    output_format, extension = get_output_format()
+    with recipe.image.open('rb') as image_file, \
+            Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        if output_format == 'JPEG':
+            image = image.convert('RGB')
+        stem = Path(original_name).stem
+        new_names = {}
+        for field, bound in settings.RECIPE_IMAGE_SIZES.items():
+            field_file = getattr(recipe, field)
+            field_file.save(f'{stem}_{field}.{extension}',
+                            render_variant(image, bound, output_format),
+                            save=False)
+            new_names[field] = field_file.name
+
+    updated = Recipe.objects.filter(
+        id=recipe_id, image=original_name
+    ).update(updated_at=timezone.now(), **new_names)
+    if updated:
+        bump_generation('recipes')
+    storage = recipe.image.storage
+    obsolete = [original_name] if updated else list(new_names.values())
+    for name in obsolete:
+        storage.delete(name)
+
+
+def process_in_background(recipe_id):
+    """Обрабатывает изображение в потоке и освобождает его соединения"""
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception('recipe %s image processing failed', recipe_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_image_processing(recipe_id):
+    """Ставит обработку изображения в очередь после фиксации транзакции"""
+    if settings.RECIPE_IMAGE_PROCESSING_ASYNC:
+        transaction.on_commit(
+            lambda: executor.submit(process_in_background, recipe_id))
+    else:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
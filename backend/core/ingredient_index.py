@@ -0,0 +1,64 @@
+import threading
+from bisect import bisect_left
+
+from django.db import DEFAULT_DB_ALIAS
+
+from core.cache import get_generation
+from core.models import Ingredient
+
+
+def normalize(value):
+    """Приводит строку к виду, в котором её сравнивает istartswith"""
+    return value.upper()
+
+
+class IngredientIndex:
+    """Префиксный индекс ингредиентов в памяти процесса.
+    Хранит отсортированный массив нормализованных названий и отвечает
+    на поиск по началу названия без обращения к базе данных"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ingredients = []
+        self._names = []
+        self._keys = []
+        self._positions = []
+
+    def _build(self, version):
+        """Загружает каталог и строит отсортированный массив названий"""
+        # индекс строится после смены поколения каталога, реплика
+        # в этот момент может еще не получить изменения
+        ingredients = list(Ingredient.objects.using(
+            DEFAULT_DB_ALIAS).order_by('id'))
+        names = [normalize(ingredient.name) for ingredient in ingredients]
+        entries = sorted(zip(names, range(len(names))))
+        self._ingredients = ingredients
+        self._names = names
+        self._keys = [key for key, _ in entries]
+        self._positions = [position for _, position in entries]
+        self._version = version
+
+    def _ensure_actual(self):
+        """Перестраивает индекс, если версия каталога изменилась"""
+        version = get_generation('ingredients')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+
+    def search(self, terms):
+        """Возвращает ингредиенты, название которых начинается
+        с каждого из переданных слов, в порядке их id"""
+        self._ensure_actual()
+        terms = [normalize(term) for term in terms]
+        prefix = max(terms, key=len)
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + '\U0010ffff', start)
+        return [
+            self._ingredients[position]
+            for position in sorted(self._positions[start:end])
+            if all(self._names[position].startswith(term) for term in terms)
+        ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,211 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.management.commands.seeddata import SEED_PASSWORD, SEED_PREFIX
+from core.models import Tag, Ingredient
+from recipes.models import Recipe, Favorite, ShoppingCart
+from users.models import User
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    """Команда для нагрузочного тестирования основных сценариев API
+    на локальном сервере, заполненном командой seeddata. Результат
+    выводится в формате json: пропускная способность и задержки
+    p50/p95/p99 по каждому сценарию"""
+    help = 'benchmark main api flows against a running server'
+
+    flows = ('feed', 'feed_filtered', 'recipe_detail',
+             'ingredient_autocomplete', 'tags', 'users_me',
+             'favorite_toggle', 'cart_toggle', 'subscriptions',
+             'cart_download')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests per flow')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--users', type=int, default=8,
+                            help='seeded users to log in as')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--flows', nargs='+', choices=self.flows,
+                            default=self.flows)
+        parser.add_argument('--output', help='write json report to file')
+        parser.add_argument('--label', default='',
+                            help='server mode label stored in the report, '
+                                 'e.g. sync or asgi')
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.rng = random.Random(options['seed'])
+        self.recipes = list(Recipe.objects.values_list('id', flat=True))
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.prefixes = sorted({
+            name[:2] for name in Ingredient.objects.values_list(
+                'name', flat=True)[:500]
+        })
+        users = list(User.objects.filter(
+            username__startswith=SEED_PREFIX
+        ).order_by('id')[:options['users']])
+        if not self.recipes or not users:
+            raise CommandError('no seed data, run seeddata first')
+
+        self.tokens = [self.login(user.email) for user in users]
+        # переключение избранного и списка покупок не должно удалять
+        # связи, созданные seeddata
+        self.linked = {
+            'favorite': [set(Favorite.objects.filter(
+                user=user).values_list('recipe_id', flat=True))
+                for user in users],
+            'shopping_cart': [set(ShoppingCart.objects.filter(
+                user=user).values_list('recipe_id', flat=True))
+                for user in users],
+        }
+        report = {
+            'label': options['label'],
+            'base_url': self.base_url,
+            'requests_per_flow': options['requests'],
+            'concurrency': options['concurrency'],
+            'flows': {}
+        }
+        for flow in options['flows']:
+            report['flows'][flow] = self.run_flow(
+                flow, options['requests'], options['concurrency'])
+
+        result = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf8') as file:
+                file.write(result)
+        self.stdout.write(result)
+
+    def request(self, method, path, token=None, params=None, data=None):
+        """Выполняет запрос и возвращает статус ответа"""
+        url = f'{self.base_url}{path}'
+        if params:
+            url = f'{url}?{urlencode(params, doseq=True)}'
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        body = json.dumps(data).encode() if data is not None else None
+        request = Request(url, data=body, headers=headers, method=method)
+        try:
+            with urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except HTTPError as error:
+            return error.code
+
+    def login(self, email):
+        request = Request(
+            f'{self.base_url}/api/auth/token/login/',
+            data=json.dumps({'email': email,
+                             'password': SEED_PASSWORD}).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urlopen(request, timeout=60) as response:
+                return json.loads(response.read())['auth_token']
+        except (HTTPError, URLError, KeyError) as error:
+            raise CommandError(f'login as {email} failed: {error}')
+
+    def build_tasks(self, flow, count):
+        """Заранее формирует запросы сценария, чтобы выбор параметров
+        не влиял на измерения и повторялся при том же seed"""
+        build = getattr(self, f'build_{flow}')
+        tasks = []
+        for number in range(count):
+            position = number % len(self.tokens)
+            tasks.append(build(position, self.tokens[position],
+                               self.rng.choice(self.recipes)))
+        return tasks
+
+    def build_feed(self, position, token, recipe):
+        params = {'page': self.rng.randint(1, 20), 'limit': 6}
+        if self.tags and self.rng.random() < 0.5:
+            params['tags'] = self.rng.sample(self.tags, min(2, len(self.tags)))
+        return [('GET', '/api/recipes/', None, params)]
+
+    def build_feed_filtered(self, position, token, recipe):
+        return [('GET', '/api/recipes/', token,
+                 {'is_favorited': 1, 'limit': 6})]
+
+    def build_recipe_detail(self, position, token, recipe):
+        return [('GET', f'/api/recipes/{recipe}/', token, None)]
+
+    def build_ingredient_autocomplete(self, position, token, recipe):
+        return [('GET', '/api/ingredients/', None,
+                 {'name': self.rng.choice(self.prefixes)})]
+
+    def build_tags(self, position, token, recipe):
+        return [('GET', '/api/tags/', None, None)]
+
+    def build_users_me(self, position, token, recipe):
+        return [('GET', '/api/users/me/', token, None)]
+
+    def build_toggle(self, action, position, token, recipe):
+        while recipe in self.linked[action][position]:
+            recipe = self.rng.choice(self.recipes)
+        path = f'/api/recipes/{recipe}/{action}/'
+        return [('POST', path, token, None), ('DELETE', path, token, None)]
+
+    def build_favorite_toggle(self, position, token, recipe):
+        return self.build_toggle('favorite', position, token, recipe)
+
+    def build_cart_toggle(self, position, token, recipe):
+        return self.build_toggle('shopping_cart', position, token, recipe)
+
+    def build_subscriptions(self, position, token, recipe):
+        return [('GET', '/api/users/subscriptions/', token,
+                 {'limit': 6, 'recipes_limit': 3})]
+
+    def build_cart_download(self, position, token, recipe):
+        return [('GET', '/api/recipes/download_shopping_cart/', token, None)]
+
+    def run_task(self, task):
+        """Выполняет запросы задачи, возвращает задержки и ошибки"""
+        latencies, errors = [], 0
+        for method, path, token, params in task:
+            started = time.perf_counter()
+            try:
+                status = self.request(method, path, token, params)
+            except URLError:
+                status = None
+            latencies.append(time.perf_counter() - started)
+            if status is None or status >= 500:
+                errors += 1
+        return latencies, errors
+
+    def run_flow(self, flow, count, concurrency):
+        tasks = self.build_tasks(flow, count)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self.run_task, tasks))
+        elapsed = time.perf_counter() - started
+        latencies = [latency for task, _ in results for latency in task]
+        errors = sum(task_errors for _, task_errors in results)
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'duration_seconds': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'latency_ms': {
+                name: round(percentile(latencies, percent) * 1000, 2)
+                for name, percent in (('p50', 50), ('p95', 95),
+                                      ('p99', 99))
+            },
+        }
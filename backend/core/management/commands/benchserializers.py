@@ -0,0 +1,122 @@
+import json
+import time
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from django.test import RequestFactory
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from api.serializers import (RecipeSerializer, UserSerializer,
+                             AddUserSerializer)
+from api.views import get_recipes, get_subscriptions
+from core.field_selection import FieldSelection
+from core.renderers import FastJSONRenderer, orjson
+from users.models import User, Subscribe
+
+
+class Command(BaseCommand):
+    """Команда для микробенчмарка сериализации списков на данных базы:
+    сравнивает скомпилированные сериализаторы списков и FastJSONRenderer
+    с сериализаторами и рендерером DRF, результат выводится в формате
+    json. Совпадение ответов проверяют тесты api"""
+    help = 'compare compiled list serializers with drf ones'
+
+    cases = {
+        'recipes': (RecipeSerializer, ''),
+        'recipe_cards': (RecipeSerializer, 'fields=id,name,image,'
+                         'cooking_time,author.first_name,'
+                         'author.last_name,tags'),
+        'recipes_compact': (RecipeSerializer,
+                            'fields=id,name,author,tags,is_favorited'),
+        'users': (UserSerializer, ''),
+        'subscriptions': (AddUserSerializer, 'recipes_limit=3'),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=100,
+                            help='objects per list')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--cases', nargs='+', choices=self.cases,
+                            default=list(self.cases))
+        parser.add_argument('--output', help='write json report to file')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(subscribers__isnull=False).first()
+        if user is None:
+            raise CommandError('no subscriptions, run seeddata first')
+
+        report = {
+            'orjson': orjson is not None,
+            'objects': options['objects'],
+            'repeat': options['repeat'],
+            'cases': {}
+        }
+        for case in options['cases']:
+            serializer_class, query = self.cases[case]
+            request = Request(RequestFactory().get(f'/api/?{query}'))
+            request.user = user
+            context = {'request': request,
+                       'fields': FieldSelection.from_request(request),
+                       'recipes_limit': 3}
+            objects = list(getattr(self, f'get_{case}', self.get_recipes)(
+                user, context)[:options['objects']])
+            report['cases'][case] = self.run_case(
+                case, serializer_class, objects, context, options['repeat'])
+
+        result = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf8') as file:
+                file.write(result)
+        self.stdout.write(result)
+
+    def get_recipes(self, user, context):
+        return get_recipes(user, context['fields'])
+
+    def get_users(self, user, context):
+        return User.objects.annotate(is_subscribed=Exists(
+            Subscribe.objects.filter(subscriber=user, author=OuterRef('pk'))
+        )).order_by('id')
+
+    def get_subscriptions(self, user, context):
+        return get_subscriptions(user, context['recipes_limit'],
+                                 context['fields'])
+
+    def run_case(self, case, serializer_class, objects, context, repeat):
+        """Сравнивает время сериализации и рендеринга"""
+        def drf():
+            return serializers.ListSerializer(
+                objects, child=serializer_class(), context=context).data
+
+        def compiled():
+            return serializer_class(objects, many=True, context=context).data
+
+        data = drf()
+        timings = {
+            'serialize_drf': self.measure(drf, repeat),
+            'serialize_compiled': self.measure(compiled, repeat),
+            'render_drf': self.measure(
+                lambda: JSONRenderer().render(data), repeat),
+            'render_fast': self.measure(
+                lambda: FastJSONRenderer().render(data), repeat),
+        }
+        return {
+            'objects': len(objects),
+            'bytes': len(JSONRenderer().render(data)),
+            'ms': timings,
+            'serialize_speedup': round(
+                timings['serialize_drf'] / timings['serialize_compiled'], 1),
+            'render_speedup': round(
+                timings['render_drf'] / timings['render_fast'], 1),
+        }
+
+    def measure(self, function, repeat):
+        """Медиана времени выполнения в миллисекундах"""
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - started)
+        return round(median(durations) * 1000, 3)
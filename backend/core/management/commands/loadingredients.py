@@ -1,21 +1,83 @@
 import csv
+import json
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from core.cache import bump_generation
 from core.models import Ingredient
 
 
 class Command(BaseCommand):
-    """Команда для загрузки ингредиентов из scv файла в базу данных"""
-    help = 'load ingredients from scv-file to db'
+    """Команда для загрузки ингредиентов из csv или json файлов
+    в базу данных. Повторный запуск не создает дубликатов"""
+    help = 'load ingredients from csv or json files to db'
 
     def add_arguments(self, parser):
-        parser.add_argument('path_to_file')
+        parser.add_argument('path_to_file', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def read_csv(self, path):
+        """Построчно читает ингредиенты из csv файла"""
+        with open(path, encoding='utf8') as csvfile:
+            for row in csv.reader(csvfile):
+                yield row[0], row[1]
+
+    def read_json(self, path):
+        """Читает ингредиенты из json файла"""
+        with open(path, encoding='utf8') as jsonfile:
+            for item in json.load(jsonfile):
+                yield item['name'], item['measurement_unit']
+
+    def read_rows(self, path):
+        """Выбирает способ чтения по расширению файла"""
+        readers = {'.csv': self.read_csv, '.json': self.read_json}
+        reader = readers.get(Path(path).suffix.lower())
+        if reader is None:
+            raise CommandError(f'unsupported file format: {path}')
+
+        return reader(path)
+
+    def load_batch(self, batch):
+        """Добавляет ингредиенты пачки, которых еще нет в базе данных,
+        возвращает количество добавленных"""
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
+        new_ingredients = [
+            Ingredient(name=name, measurement_unit=measurement_unit)
+            for name, measurement_unit in batch
+            if (name, measurement_unit) not in existing
+        ]
+        Ingredient.objects.bulk_create(new_ingredients,
+                                       ignore_conflicts=True)
+        return len(new_ingredients)
 
     def handle(self, *args, **options):
-        with open(options['path_to_file'], encoding='utf8') as csvfile:
-            data = csv.reader(csvfile)
-            for row in data:
-                Ingredient.objects.create(name=row[0], measurement_unit=row[1])
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('batch size must be positive')
+
+        inserted = skipped = 0
+        seen = set()
+        with transaction.atomic():
+            for path in options['path_to_file']:
+                rows = self.read_rows(path)
+                while batch := list(islice(rows, batch_size)):
+                    unique_batch = []
+                    for row in batch:
+                        if row in seen:
+                            continue
+                        seen.add(row)
+                        unique_batch.append(row)
+                    added = self.load_batch(unique_batch)
+                    inserted += added
+                    skipped += len(batch) - added
+            transaction.on_commit(lambda: bump_generation('ingredients'))
 
-        self.stdout.write('ingredients successfully upload')
+        self.stdout.write(
+            f'ingredients successfully upload: inserted {inserted}, '
+            f'skipped {skipped}'
+        )
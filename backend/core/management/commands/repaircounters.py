@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import recount
+from recipes.models import Recipe, Favorite
+from users.models import User, Subscribe
+
+
+class Command(BaseCommand):
+    """Команда для пересчета денормализованных счетчиков избранного,
+    рецептов и подписчиков, например после массовых операций в обход
+    сигналов"""
+    help = 'recompute favorites, recipes and followers counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = recount(Recipe.objects.all(), 'favorites_count',
+                          Favorite, 'recipe', batch_size)
+        recount(User.objects.all(), 'recipes_count',
+                Recipe, 'author', batch_size)
+        users = recount(User.objects.all(), 'followers_count',
+                        Subscribe, 'author', batch_size)
+        self.stdout.write(
+            f'counters successfully recomputed: {recipes} recipes, '
+            f'{users} users'
+        )
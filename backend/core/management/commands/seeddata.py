@@ -0,0 +1,227 @@
+import random
+from collections import defaultdict
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from core.cache import bump_generation
+from core.counters import recount
+from core.feed import backfill
+from core.models import Tag, Ingredient
+from core.recipe_index import GENERATION
+from recipes.models import Recipe, IngredientInRecipe, Favorite, ShoppingCart
+from users.models import User, Subscribe
+
+SEED_PREFIX = 'seed_'
+SEED_PASSWORD = 'seed-password'
+SEED_IMAGE = 'core/images/seed.png'
+
+
+def batched(iterable, size):
+    """Разбивает последовательность на пачки заданного размера"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    """Команда для заполнения базы данных воспроизводимым набором
+    синтетических пользователей, рецептов, избранного, списков покупок
+    и подписок для нагрузочного тестирования"""
+    help = 'seed db with reproducible synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes-per-user', type=int, default=10)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=6)
+        parser.add_argument('--tags-per-recipe', type=int, default=2)
+        parser.add_argument('--favorite-density', type=float, default=0.01)
+        parser.add_argument('--cart-density', type=float, default=0.005)
+        parser.add_argument('--subscription-density', type=float,
+                            default=0.05)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true',
+                            help='delete previously seeded users first')
+
+    def handle(self, *args, **options):
+        for density in ('favorite_density', 'cart_density',
+                        'subscription_density'):
+            if not 0 <= options[density] <= 1:
+                raise CommandError(f'{density} must be between 0 and 1')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            if options['clear']:
+                User.objects.filter(username__startswith=SEED_PREFIX).delete()
+            elif User.objects.filter(
+                    username__startswith=SEED_PREFIX).exists():
+                raise CommandError('seed data already exists, use --clear')
+
+            tags = self.create_tags(options['tags'])
+            ingredients = self.get_ingredients(
+                options['ingredients_per_recipe'])
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, options['recipes_per_user'])
+            self.link_tags(recipes, tags, options['tags_per_recipe'])
+            self.link_ingredients(recipes, ingredients,
+                                  options['ingredients_per_recipe'])
+            favorites = self.link_users(
+                Favorite, 'recipe_id', users, recipes,
+                options['favorite_density'])
+            carts = self.link_users(
+                ShoppingCart, 'recipe_id', users, recipes,
+                options['cart_density'])
+            subscriptions = self.create_subscriptions(
+                users, options['subscription_density'])
+            self.update_counters()
+            self.fill_feeds()
+            transaction.on_commit(lambda: bump_generation(
+                'recipes', 'tags', 'ingredients', 'users', GENERATION))
+
+        self.stdout.write(
+            f'seed data successfully created: {len(users)} users, '
+            f'{len(recipes)} recipes, {favorites} favorites, '
+            f'{carts} shopping cart items, {subscriptions} subscriptions'
+        )
+
+    def update_counters(self):
+        """Пересчитывает счетчики, которые bulk_create не обновляет"""
+        recipes = Recipe.objects.filter(
+            author__username__startswith=SEED_PREFIX)
+        users = User.objects.filter(username__startswith=SEED_PREFIX)
+        recount(recipes, 'favorites_count', Favorite, 'recipe',
+                self.batch_size)
+        recount(users, 'recipes_count', Recipe, 'author', self.batch_size)
+        recount(users, 'followers_count', Subscribe, 'author',
+                self.batch_size)
+
+    def fill_feeds(self):
+        """Заполняет ленты подписок, которые bulk_create не заполняет"""
+        authors = defaultdict(list)
+        for subscriber_id, author_id in Subscribe.objects.filter(
+                subscriber__username__startswith=SEED_PREFIX).values_list(
+                'subscriber_id', 'author_id'):
+            authors[subscriber_id].append(author_id)
+        for subscriber_id, author_ids in authors.items():
+            backfill(subscriber_id, author_ids)
+
+    def bulk_create(self, model, objects):
+        for batch in batched(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def create_tags(self, count):
+        """Создает недостающие теги, распределение тегов по рецептам
+        неравномерное: первые теги встречаются чаще"""
+        for number in range(count):
+            Tag.objects.get_or_create(
+                slug=f'{SEED_PREFIX}{number}',
+                defaults={
+                    'name': f'Тег {number}',
+                    'color': '#{0:06X}'.format(self.rng.randrange(0xFFFFFF))
+                }
+            )
+        return list(Tag.objects.filter(
+            slug__startswith=SEED_PREFIX).order_by('id').values_list(
+            'id', flat=True))[:count]
+
+    def get_ingredients(self, minimum):
+        """Возвращает id ингредиентов каталога, дополняя каталог
+        синтетическими ингредиентами, если их не хватает"""
+        missing = minimum - Ingredient.objects.count()
+        if missing > 0:
+            Ingredient.objects.bulk_create(
+                Ingredient(name=f'{SEED_PREFIX}ingredient {number}',
+                           measurement_unit='г')
+                for number in range(missing)
+            )
+        return list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        self.bulk_create(User, (
+            User(
+                username=f'{SEED_PREFIX}{number}',
+                email=f'{SEED_PREFIX}{number}@example.com',
+                first_name=f'Имя {number}',
+                last_name=f'Фамилия {number}',
+                password=password
+            ) for number in range(count)
+        ))
+        return list(User.objects.filter(
+            username__startswith=SEED_PREFIX).order_by('id').values_list(
+            'id', flat=True))
+
+    def create_recipes(self, users, per_user):
+        if not default_storage.exists(SEED_IMAGE):
+            image = BytesIO()
+            Image.new('RGB', (64, 64), '#D9D9D9').save(image, 'PNG')
+            default_storage.save(SEED_IMAGE, ContentFile(image.getvalue()))
+        words = ('суп', 'салат', 'пирог', 'рагу', 'каша', 'омлет',
+                 'запеканка', 'паста', 'котлеты', 'блины')
+        self.bulk_create(Recipe, (
+            Recipe(
+                author_id=user_id,
+                name=f'{self.rng.choice(words)} {position}-{number}',
+                text=' '.join(self.rng.choices(words, k=20)),
+                cooking_time=self.rng.randint(5, 180),
+                image=SEED_IMAGE
+            ) for position, user_id in enumerate(users)
+            for number in range(per_user)
+        ))
+        return list(Recipe.objects.filter(
+            author__username__startswith=SEED_PREFIX).order_by(
+            'id').values_list('id', flat=True))
+
+    def link_tags(self, recipes, tags, per_recipe):
+        if not tags:
+            return
+
+        weights = [1 / (position + 1) for position in range(len(tags))]
+        through = Recipe.tags.through
+        links = []
+        for recipe_id in recipes:
+            chosen = set(self.rng.choices(tags, weights,
+                                          k=min(per_recipe, len(tags))))
+            links.extend(through(recipe_id=recipe_id, tag_id=tag_id)
+                         for tag_id in chosen)
+        self.bulk_create(through, links)
+
+    def link_ingredients(self, recipes, ingredients, per_recipe):
+        self.bulk_create(IngredientInRecipe, (
+            IngredientInRecipe(recipe_id=recipe_id, ingredient_id=ingredient,
+                               amount=self.rng.randint(1, 500))
+            for recipe_id in recipes
+            for ingredient in self.rng.sample(ingredients, per_recipe)
+        ))
+
+    def link_users(self, model, field, users, objects, density):
+        """Связывает каждого пользователя с долей density объектов"""
+        count = round(len(objects) * density)
+        self.bulk_create(model, (
+            model(user_id=user_id, **{field: object_id})
+            for user_id in users
+            for object_id in self.rng.sample(objects, count)
+        ))
+        return count * len(users)
+
+    def create_subscriptions(self, users, density):
+        count = max(min(round(len(users) * density), len(users) - 1), 0)
+        self.bulk_create(Subscribe, (
+            Subscribe(subscriber_id=user_id, author_id=author_id)
+            for user_id in users
+            for author_id in [
+                author for author in self.rng.sample(users, count + 1)
+                if author != user_id
+            ][:count]
+        ))
+        return count * len(users)
@@ -0,0 +1,105 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry,
+                               Counter, Histogram, generate_latest)
+from prometheus_client import REGISTRY, multiprocess
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LABELS = ('view', 'method')
+
+REQUESTS = Counter(
+    'foodgram_requests', 'Количество запросов',
+    LABELS + ('status',))
+LATENCY = Histogram(
+    'foodgram_request_latency_seconds', 'Время обработки запроса',
+    LABELS, buckets=LATENCY_BUCKETS)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'Количество запросов к базе данных',
+    LABELS, buckets=QUERY_BUCKETS)
+DB_TIME = Histogram(
+    'foodgram_db_time_seconds', 'Время запросов к базе данных',
+    LABELS, buckets=LATENCY_BUCKETS)
+SERIALIZER_TIME = Histogram(
+    'foodgram_serializer_time_seconds', 'Время сериализации ответа',
+    LABELS, buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'foodgram_response_size_bytes', 'Размер тела ответа',
+    LABELS, buckets=SIZE_BUCKETS)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса, которые собирают обертка запросов
+    к базе данных и сериализаторы"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = 'unknown'
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения запросов к базе данных"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def observe(self, method, status, size):
+        """Записывает собранные значения в метрики"""
+        labels = (self.view, method)
+        REQUESTS.labels(*labels, status).inc()
+        LATENCY.labels(*labels).observe(time.perf_counter() - self.started)
+        DB_QUERIES.labels(*labels).observe(self.queries)
+        DB_TIME.labels(*labels).observe(self.db_time)
+        SERIALIZER_TIME.labels(*labels).observe(self.serializer_time)
+        if size is not None:
+            RESPONSE_SIZE.labels(*labels).observe(size)
+
+
+@contextmanager
+def serialization_timer():
+    """Учитывает время сериализации внутри блока в метриках запроса,
+    вложенные блоки не учитываются повторно"""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+
+    metrics.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_depth -= 1
+        if not metrics.serializer_depth:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Учитывает время сериализации в метриках запроса,
+    вложенные сериализаторы не учитываются повторно"""
+    def to_representation(self, instance):
+        with serialization_timer():
+            return super().to_representation(instance)
+
+
+def render_metrics():
+    """Возвращает метрики в текстовом формате Prometheus, при запуске
+    в нескольких процессах gunicorn значения суммируются по процессам"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
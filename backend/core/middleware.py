@@ -0,0 +1,165 @@
+import gzip
+import re
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from core.metrics import RequestMetrics, current_metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+class MetricsMiddleware:
+    """Собирает время ответа, количество и время запросов к базе данных,
+    время сериализации и размер ответа по действиям вьюсетов.
+    Работает как в синхронном, так и в асинхронном режиме"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        self.install(metrics)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self.finish(request, metrics, 500, None)
+            raise
+        finally:
+            current_metrics.reset(token)
+
+        return self.process_response(request, response, metrics)
+
+    async def __acall__(self, request):
+        """Асинхронный вариант: запросы асинхронного ORM выполняются
+        в потоке синхронного кода запроса, обертка ставится там же"""
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        await sync_to_async(self.install)(metrics)
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            await sync_to_async(self.finish)(request, metrics, 500, None)
+            raise
+        finally:
+            current_metrics.reset(token)
+
+        if response.streaming:
+            return self.process_response(request, response, metrics)
+
+        await sync_to_async(self.finish)(
+            request, metrics, response.status_code, len(response.content))
+        return response
+
+    def install(self, metrics):
+        for connection in connections.all():
+            # обертки потоковых ответов, которые не были дочитаны,
+            # не должны учитывать запросы следующих запросов
+            connection.execute_wrappers[:] = [
+                wrapper for wrapper in connection.execute_wrappers
+                if not isinstance(wrapper, RequestMetrics)
+            ]
+            connection.execute_wrappers.append(metrics)
+
+    def process_response(self, request, response, metrics):
+        if response.streaming:
+            response.streaming_content = self.count_streaming(
+                request, response.streaming_content,
+                response.status_code, metrics)
+        else:
+            self.finish(request, metrics, response.status_code,
+                        len(response.content))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Определяет имя действия вьюсета для меток метрик"""
+        metrics = current_metrics.get()
+        if metrics is None:
+            return None
+
+        view_class = (getattr(view_func, 'cls', None)
+                      or getattr(view_func, 'view_class', None))
+        actions = getattr(view_func, 'actions', None) or {}
+        if view_class is None:
+            metrics.view = view_func.__name__
+        else:
+            action = actions.get(request.method.lower(),
+                                 request.method.lower())
+            metrics.view = f'{view_class.__name__}.{action}'
+        return None
+
+    def count_streaming(self, request, content, status, metrics):
+        """Считает размер потокового ответа и завершает сбор метрик
+        после отправки последней части"""
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.finish(request, metrics, status, size)
+
+    def finish(self, request, metrics, status, size):
+        for connection in connections.all():
+            if metrics in connection.execute_wrappers:
+                connection.execute_wrappers.remove(metrics)
+        metrics.observe(request.method, status, size)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Сжимает ответы JSON размером от RESPONSE_COMPRESSION['MIN_SIZE']
+    байт: brotli, если он установлен и клиент его принимает, иначе gzip.
+    Ответ, который при сжатии не уменьшается, отдается как есть"""
+    def process_response(self, request, response):
+        if (response.streaming or response.has_header('Content-Encoding')
+                or not response.get('Content-Type', '').startswith(
+                    'application/json')):
+            return response
+
+        options = settings.RESPONSE_COMPRESSION
+        if len(response.content) < options['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and ACCEPTS_BROTLI.search(accept_encoding):
+            encoding = 'br'
+            content = brotli.compress(
+                response.content, quality=options['BROTLI_QUALITY'])
+        elif ACCEPTS_GZIP.search(accept_encoding):
+            encoding = 'gzip'
+            content = gzip.compress(
+                response.content, compresslevel=options['GZIP_LEVEL'],
+                mtime=0)
+        else:
+            return response
+
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # сжатый ответ побайтно отличается от несжатого
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = f'W/{etag}'
+        return response
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:18
+
+from itertools import groupby
+from operator import attrgetter
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Объединяет повторно загруженные ингредиенты перед добавлением
+    ограничения уникальности, ссылки из рецептов переносятся на оригинал.
+    Если рецепт ссылается на несколько копий одного ингредиента,
+    количество копий складывается в одной строке рецепта"""
+    Ingredient = apps.get_model("core", "Ingredient")
+    IngredientInRecipe = apps.get_model("recipes", "IngredientInRecipe")
+    duplicates = (
+        Ingredient.objects.values("name", "measurement_unit")
+        .annotate(original_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        original_id = duplicate["original_id"]
+        copies = Ingredient.objects.filter(
+            name=duplicate["name"],
+            measurement_unit=duplicate["measurement_unit"],
+        ).exclude(id=original_id)
+        rows = IngredientInRecipe.objects.filter(
+            Q(ingredient_id=original_id) | Q(ingredient__in=copies)
+        ).order_by("recipe_id", "id")
+        for _, recipe_rows in groupby(rows, key=attrgetter("recipe_id")):
+            recipe_rows = list(recipe_rows)
+            # остается строка оригинала, если она есть, иначе первая
+            kept = next(
+                (row for row in recipe_rows if row.ingredient_id == original_id),
+                recipe_rows[0],
+            )
+            merged = [row for row in recipe_rows if row is not kept]
+            if not merged and kept.ingredient_id == original_id:
+                continue
+
+            IngredientInRecipe.objects.filter(
+                id__in=[row.id for row in merged]
+            ).delete()
+            kept.amount += sum(row.amount for row in merged)
+            kept.ingredient_id = original_id
+            kept.save(update_fields=["ingredient", "amount"])
+        copies.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_alter_ingredient_measurement_unit_and_more"),
+        ("recipes", "0003_alter_favorite_recipe_alter_favorite_user_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="ingredient",
+            constraint=models.UniqueConstraint(
+                fields=("name", "measurement_unit"), name="unique_ingredient"
+            ),
+        ),
+    ]
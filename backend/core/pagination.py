@@ -1,5 +1,224 @@
-from rest_framework import pagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import attrgetter, or_
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework import exceptions, pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.async_db import gather_queries
 
 
 class FoodgramPagination(pagination.PageNumberPagination):
+    """Постраничная пагинация с необязательным режимом курсора.
+    Курсорный режим включается параметром cursor (пустым для первой
+    страницы) и строит страницы по ключу из полей keyset_ordering
+    вьюсета без подсчета количества объектов и OFFSET"""
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_page_size = 6
+    invalid_cursor_message = 'Некорректный курсор'
+    # параметры, которые задают свой порядок выборки и не совместимы
+    # с курсором по ключу keyset_ordering
+    cursor_conflicting_params = ('ordering', 'search')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_cursor_mode(request, view):
+            return super().paginate_queryset(queryset, request, view)
+
+        queryset, page_size = self.get_cursor_queryset(queryset, request)
+        return self.get_cursor_page(list(queryset[:page_size + 1]),
+                                    page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Асинхронный вариант paginate_queryset. Количество объектов
+        и объекты страницы запрашиваются одновременно"""
+        if self.is_cursor_mode(request, view):
+            queryset, page_size = self.get_cursor_queryset(queryset, request)
+            page = [obj async for obj in queryset[:page_size + 1]]
+            return self.get_cursor_page(page, page_size)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        page_number = request.query_params.get(self.page_query_param, 1)
+        try:
+            number = int(page_number)
+        except (TypeError, ValueError):
+            number = 0
+        if number < 1:
+            # номер последней страницы зависит от количества объектов,
+            # а ошибку для некорректного номера формирует paginate_queryset
+            return await sync_to_async(self.paginate_queryset)(
+                queryset, request, view)
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        bottom = (number - 1) * page_size
+        paginator.count, objects = await gather_queries(
+            queryset.count, lambda: list(queryset[bottom:bottom + page_size]))
+        try:
+            self.page = paginator.page(number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+
+        self.page.object_list = objects
+        self.request = request
+        return objects
+
+    def paginate_merged(self, querysets, request, view):
+        """Курсорная страница из нескольких выборок с общим ключом
+        keyset_ordering: из каждой выборки берется страница после позиции
+        курсора, затем страницы сливаются"""
+        self.keyset_ordering = view.keyset_ordering
+        self.use_cursor = True
+        objects = []
+        for queryset in querysets:
+            queryset, page_size = self.get_cursor_queryset(queryset, request)
+            objects.extend(queryset[:page_size + 1])
+        for field in reversed(self.keyset_ordering):
+            objects.sort(key=attrgetter(field.lstrip('-')),
+                         reverse=field.startswith('-') != self.reverse)
+        return self.get_cursor_page(objects[:page_size + 1], page_size)
+
+    def is_cursor_mode(self, request, view):
+        self.keyset_ordering = getattr(view, 'keyset_ordering', None)
+        self.use_cursor = (self.keyset_ordering is not None
+                           and self.cursor_query_param in request.query_params)
+        if self.use_cursor:
+            conflicting = [param for param in self.cursor_conflicting_params
+                           if request.query_params.get(param)]
+            if conflicting:
+                raise exceptions.ValidationError({
+                    self.cursor_query_param: 'Курсор не совместим '
+                    'с параметрами: {0}'.format(', '.join(conflicting))})
+        return self.use_cursor
+
+    def get_cursor_queryset(self, queryset, request):
+        """Упорядочивает выборку по ключу и отбирает объекты после позиции
+        курсора, возвращает выборку и размер страницы"""
+        self.request = request
+        page_size = self.get_page_size(request) or self.cursor_page_size
+        position, reverse = self.decode_cursor(request)
+        ordering = [self.reverse_field(field) if reverse else field
+                    for field in self.keyset_ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_position_filter(
+                    ordering, position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        self.position, self.reverse = position, reverse
+        return queryset, page_size
+
+    def get_cursor_page(self, page, page_size):
+        """Формирует страницу из выборки на один объект больше
+        размера страницы и позиции соседних страниц"""
+        position, reverse = self.position, self.reverse
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        has_next = has_more if not reverse else position is not None
+        has_previous = position is not None if not reverse else has_more
+        self.next_position = (self.get_position(page[-1])
+                              if page and has_next else None)
+        self.previous_position = (self.get_position(page[0])
+                                  if page and has_previous else None)
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.encode_cursor(self.next_position, False)),
+            ('previous', self.encode_cursor(self.previous_position, True)),
+            ('results', data)
+        ]))
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_position(self, obj):
+        """Возвращает значения ключевых полей объекта"""
+        position = []
+        for field in self.keyset_ordering:
+            value = getattr(obj, field.lstrip('-'))
+            position.append(value.isoformat() if hasattr(value, 'isoformat')
+                            else value)
+        return position
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """Строит условие «после позиции» для составного ключа"""
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): position[number]
+                for number, previous in enumerate(ordering[:index])
+            }
+            conditions.append(Q(**equal, **{
+                f'{name}__{lookup}': position[index]}))
+        return reduce(or_, conditions)
+
+    def decode_cursor(self, request):
+        """Возвращает позицию и направление из параметра cursor"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if (not isinstance(position, list)
+                or len(position) != len(self.keyset_ordering)
+                or not all(map(self.is_position_value, position))):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    @staticmethod
+    def is_position_value(value):
+        """Значения ключа в курсоре - строки (даты в формате ISO)
+        и целые числа в пределах bigint"""
+        if isinstance(value, int):
+            return -2 ** 63 <= value < 2 ** 63
+        return isinstance(value, str)
+
+    def encode_cursor(self, position, reverse):
+        if position is None:
+            return None
+
+        cursor = json.dumps({'p': position, 'r': int(reverse)})
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class RankedPagination(FoodgramPagination):
+    """Постраничная пагинация упорядоченных результатов поиска,
+    которые не выводятся целиком и не поддерживают режим курсора"""
+    page_size = 6
+
+    def is_cursor_mode(self, request, view):
+        self.use_cursor = False
+        return False
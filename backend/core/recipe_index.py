@@ -0,0 +1,332 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from core.cache import get_cache, get_generation
+from recipes.models import IngredientInRecipe
+
+GENERATION = 'recipe_ingredients'
+# количество установленных битов в каждом значении байта
+BYTE_POPCOUNT = bytes(bin(value).count('1') for value in range(256))
+CHUNK_SIZE = 4096
+# id рецептов BigAutoField, поэтому массивы 64-битные
+ARRAY_TYPE = 'Q'
+
+
+def journal_key(epoch, name):
+    return f'recipe_index:{epoch}:{name}'
+
+
+def record_change(recipe_id):
+    """Записывает в журнал изменений id рецепта, у которого изменился
+    состав, индексы всех процессов применят изменение при следующем
+    поиске"""
+    cache = get_cache()
+    epoch = get_generation(GENERATION)
+    counter = journal_key(epoch, 'head')
+    cache.add(counter, 0, None)
+    number = cache.incr(counter)
+    cache.set(journal_key(epoch, number), recipe_id,
+              settings.RECIPE_INGREDIENT_INDEX['JOURNAL_TIMEOUT'])
+
+
+def to_bytes(bitmap):
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+def popcount(bitmap):
+    """Количество установленных битов, int.bit_count есть с Python 3.10"""
+    if hasattr(bitmap, 'bit_count'):
+        return bitmap.bit_count()
+
+    return sum(to_bytes(bitmap).translate(BYTE_POPCOUNT))
+
+
+def to_bitmap(recipes):
+    """Возвращает битовую карту id рецептов, массив id переводится
+    в битовую карту через массив байтов"""
+    if isinstance(recipes, int):
+        return recipes
+
+    bits = bytearray((recipes[-1] >> 3) + 1 if recipes else 0)
+    for recipe_id in recipes:
+        bits[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def descending_ids(bitmap, skip=0):
+    """Перебирает id битовой карты по убыванию, пропуская skip первых.
+    Карта обходится кусками, чтобы не копировать ее целиком на каждом id"""
+    data = to_bytes(bitmap)
+    for end in range(len(data), 0, -CHUNK_SIZE):
+        start = max(end - CHUNK_SIZE, 0)
+        chunk = int.from_bytes(data[start:end], 'little')
+        if skip:
+            count = popcount(chunk)
+            if skip >= count:
+                skip -= count
+                continue
+
+        while chunk:
+            position = chunk.bit_length() - 1
+            chunk ^= 1 << position
+            if skip:
+                skip -= 1
+                continue
+            yield start * 8 + position
+
+
+def add_bitmap(slices, bitmap):
+    """Прибавляет битовую карту к счетчикам, разложенным по разрядам:
+    в slices[n] установлены биты рецептов, у которых n-й разряд
+    количества совпавших ингредиентов равен единице"""
+    carry = bitmap
+    for position, value in enumerate(slices):
+        slices[position] = value ^ carry
+        carry &= value
+        if not carry:
+            return
+    slices.append(carry)
+
+
+def has_recipe(recipes, recipe_id):
+    if isinstance(recipes, int):
+        return bool(recipes >> recipe_id & 1)
+
+    position = bisect_left(recipes, recipe_id)
+    return position < len(recipes) and recipes[position] == recipe_id
+
+
+def without_recipe(recipes, recipe_id):
+    """Возвращает новый набор рецептов без recipe_id, массив не изменяется
+    на месте: его в это время может читать поиск в другом потоке"""
+    if isinstance(recipes, int):
+        return recipes & ~(1 << recipe_id)
+
+    position = bisect_left(recipes, recipe_id)
+    return recipes[:position] + recipes[position + 1:]
+
+
+def with_recipe(recipes, recipe_id):
+    """Возвращает новый набор рецептов с recipe_id"""
+    if isinstance(recipes, int):
+        return recipes | 1 << recipe_id
+
+    position = bisect_left(recipes, recipe_id)
+    return (recipes[:position] + array(ARRAY_TYPE, [recipe_id])
+            + recipes[position:])
+
+
+class RecipeIngredientIndex:
+    """Обратный индекс ингредиентов в памяти процесса.
+    Для каждого ингредиента хранит id рецептов с ним: редкие ингредиенты
+    отсортированным массивом, частые - битовой картой. Рецепты также
+    разложены по битовым картам количества ингредиентов. Изменения
+    рецептов применяются по журналу в кэше без полной перестройки
+    индекса. Поиск читает индекс без блокировки, поэтому изменения
+    собираются в копиях словарей и массивов, а затем заменяют
+    состояние индекса одним присваиванием"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._head = 0
+        self._gap_since = None
+        # ингредиенты и количества ингредиентов с наборами их рецептов
+        self._state = ({}, {})
+
+    def _build(self, epoch):
+        """Загружает составы всех рецептов из основной базы"""
+        head = get_cache().get(journal_key(epoch, 'head'), 0)
+        postings = {}
+        sizes = {}
+        rows = IngredientInRecipe.objects.using(DEFAULT_DB_ALIAS).order_by(
+            'recipe_id').values_list('recipe_id', 'ingredient_id')
+        current, size = None, 0
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=10000):
+            if ingredient_id not in postings:
+                postings[ingredient_id] = array(ARRAY_TYPE)
+            postings[ingredient_id].append(recipe_id)
+            if recipe_id != current:
+                if current is not None:
+                    sizes.setdefault(size, array(ARRAY_TYPE)).append(
+                        current)
+                current, size = recipe_id, 0
+            size += 1
+        if current is not None:
+            sizes.setdefault(size, array(ARRAY_TYPE)).append(current)
+
+        # битовая карта занимает бит на каждый id, элемент массива - 64,
+        # частые ингредиенты хранятся картой, даже если она вдвое больше
+        # массива: перевод массива в карту при поиске медленный
+        dense = (current or 0) // 128
+        self._state = (
+            {ingredient_id: to_bitmap(recipes) if len(recipes) > dense
+             else recipes
+             for ingredient_id, recipes in postings.items()},
+            {size: to_bitmap(recipes) for size, recipes in sizes.items()}
+        )
+        self._epoch = epoch
+        self._head = head
+        self._gap_since = None
+
+    def _apply(self, recipe_ids):
+        """Заменяет в индексе составы рецептов актуальными из базы"""
+        compositions = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.using(
+                DEFAULT_DB_ALIAS).filter(recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            compositions[recipe_id].append(ingredient_id)
+
+        postings, sizes = (dict(index) for index in self._state)
+        for recipe_id, ingredients in compositions.items():
+            for index in (postings, sizes):
+                for key, recipes in index.items():
+                    if has_recipe(recipes, recipe_id):
+                        index[key] = without_recipe(recipes, recipe_id)
+            for ingredient_id in ingredients:
+                postings[ingredient_id] = with_recipe(
+                    postings.get(ingredient_id, array(ARRAY_TYPE)),
+                    recipe_id)
+            if ingredients:
+                sizes[len(ingredients)] = with_recipe(
+                    sizes.get(len(ingredients), 0), recipe_id)
+        self._state = (postings, sizes)
+
+    def _catch_up(self, head):
+        """Применяет изменения из журнала. Запись может еще не появиться
+        после увеличения счетчика, но если ее нет дольше GAP_TIMEOUT
+        или изменений больше MAX_CHANGES, индекс строится заново"""
+        options = settings.RECIPE_INGREDIENT_INDEX
+        if head - self._head > options['MAX_CHANGES']:
+            self._build(self._epoch)
+            return
+
+        numbers = range(self._head + 1, head + 1)
+        entries = get_cache().get_many(
+            [journal_key(self._epoch, number) for number in numbers])
+        changed = set()
+        applied = self._head
+        for number in numbers:
+            recipe_id = entries.get(journal_key(self._epoch, number))
+            if recipe_id is None:
+                break
+            changed.add(recipe_id)
+            applied = number
+
+        if applied < head:
+            now = time.monotonic()
+            self._gap_since = self._gap_since or now
+            if now - self._gap_since > options['GAP_TIMEOUT']:
+                self._build(self._epoch)
+                return
+        else:
+            self._gap_since = None
+        if changed:
+            self._apply(changed)
+        self._head = applied
+
+    def _ensure_actual(self):
+        """Перестраивает индекс после смены поколения или догоняет журнал"""
+        epoch = get_generation(GENERATION)
+        head = get_cache().get(journal_key(epoch, 'head'), 0)
+        if epoch == self._epoch and head == self._head:
+            return
+
+        with self._lock:
+            # пока поток ждал блокировку, другой поток мог уже догнать
+            # журнал, поэтому поколение и счетчик читаются заново
+            epoch = get_generation(GENERATION)
+            head = get_cache().get(journal_key(epoch, 'head'), 0)
+            if epoch != self._epoch or head < self._head:
+                # счетчик журнала мог пропасть из кэша вместе с записями
+                self._build(epoch)
+            elif head > self._head:
+                self._catch_up(head)
+
+    def search(self, ingredient_ids, max_missing=None):
+        """Возвращает id рецептов, в которых есть хотя бы один
+        из переданных ингредиентов, по возрастанию числа недостающих
+        ингредиентов, затем по убыванию имеющихся и от новых рецептов
+        к старым. max_missing ограничивает число недостающих"""
+        self._ensure_actual()
+        postings, sizes = self._state
+        slices = []
+        for ingredient_id in set(ingredient_ids):
+            if ingredient_id in postings:
+                add_bitmap(slices, to_bitmap(postings[ingredient_id]))
+        return RankedRecipes(slices, sizes, max_missing)
+
+
+class RankedRecipes:
+    """Результат поиска по имеющимся ингредиентам, разбитый на битовые
+    карты рецептов с одинаковым количеством недостающих и имеющихся
+    ингредиентов. Срез перебирает только нужные карты, поэтому
+    результат можно передать пагинатору"""
+    def __init__(self, slices, sizes, max_missing):
+        found = reduce(or_, slices, 0)
+        # разбиение найденных рецептов по количеству совпадений
+        matches = {0: found} if found else {}
+        for position, value in enumerate(slices):
+            split = {}
+            for matched, bitmap in matches.items():
+                ones = bitmap & value
+                if ones:
+                    split[matched | 1 << position] = ones
+                if ones != bitmap:
+                    split[matched] = bitmap ^ ones
+            matches = split
+
+        largest = max(sizes, default=0)
+        if max_missing is not None:
+            largest = min(largest, max_missing)
+        self.buckets = []
+        for missing in range(largest + 1):
+            for matched in sorted(matches, reverse=True):
+                bucket = matches[matched] & sizes.get(matched + missing, 0)
+                if bucket:
+                    self.buckets.append(bucket)
+        self.found = found if max_missing is None else None
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = popcount(
+                self.found if self.found is not None
+                else reduce(or_, self.buckets, 0))
+        return self._count
+
+    def count(self):
+        return len(self)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+
+        start, stop, _ = key.indices(len(self))
+        limit = stop - start
+        ids = []
+        for bucket in self.buckets:
+            if len(ids) >= limit:
+                break
+
+            if start:
+                count = popcount(bucket)
+                if start >= count:
+                    start -= count
+                    continue
+
+            for recipe_id in descending_ids(bucket, start):
+                ids.append(recipe_id)
+                if len(ids) >= limit:
+                    break
+            start = 0
+        return ids
+
+
+recipe_index = RecipeIngredientIndex()
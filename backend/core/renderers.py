@@ -0,0 +1,39 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSONRenderer экранирует разделители строк, которые не допускает JavaScript
+LINE_SEPARATORS = (('\u2028'.encode(), b'\\u2028'),
+                   ('\u2029'.encode(), b'\\u2029'))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON рендерер на orjson, если он установлен, с тем же выводом,
+    что и JSONRenderer. Даты и значения, которые orjson не сериализует,
+    преобразует кодировщик DRF. Ответы с отступами, настройки вывода
+    DRF, отличные от стандартных, и данные, на которых orjson
+    завершается ошибкой, обрабатывает JSONRenderer"""
+    options = 0 if orjson is None else (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact or self.get_indent(
+                    accepted_media_type, renderer_context or {})):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options)
+        except TypeError:
+            return super().render(
+                data, accepted_media_type, renderer_context)
+
+        for separator, escaped in LINE_SEPARATORS:
+            content = content.replace(separator, escaped)
+        return content
@@ -0,0 +1,115 @@
+import csv
+import json
+import tempfile
+
+from django.db.models import (Case, CharField, F, IntegerField, Max, Min,
+                              Sum, Value, When)
+
+from recipes.models import IngredientInRecipe
+
+# единицы измерения каталога ингредиентов, которые пересчитываются
+# в основную единицу той же величины: единица - (основная, множитель).
+# Стакан считается граненым, 200 мл
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+    'стакан': ('мл', 200),
+    'ст. л.': ('мл', 15),
+    'ч. л.': ('мл', 5),
+}
+# размер списка покупок, после которого временный файл переносится на диск
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class Echo:
+    """Псевдобуфер, возвращающий записанную строку вместо её хранения"""
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    """Суммирует количество ингредиентов из списка покупок пользователя
+    одним запросом к базе данных. Количество ингредиента в разных
+    единицах одной величины переводится в основную единицу, поэтому
+    ингредиент в граммах и килограммах попадает в список одной строкой.
+    Ингредиент, который указан в рецептах в одной единице, выводится
+    в ней"""
+    unit = F('ingredient__measurement_unit')
+    single_unit = When(first_unit=F('last_unit'), then=F('first_unit'))
+    return IngredientInRecipe.objects.filter(
+        recipe__shoppingcart__user=user
+    ).values(
+        name=F('ingredient__name'),
+        base_unit=Case(*(
+            When(ingredient__measurement_unit=source, then=Value(target))
+            for source, (target, _) in UNIT_CONVERSIONS.items()
+        ), default=unit, output_field=CharField())
+    ).annotate(
+        first_unit=Min(unit),
+        last_unit=Max(unit),
+        unit_amount=Sum('amount'),
+        base_amount=Sum(Case(*(
+            When(ingredient__measurement_unit=source,
+                 then=F('amount') * factor)
+            for source, (_, factor) in UNIT_CONVERSIONS.items()
+        ), default=F('amount'), output_field=IntegerField()))
+    ).annotate(
+        measurement_unit=Case(single_unit, default=F('base_unit')),
+        total_amount=Case(
+            When(first_unit=F('last_unit'), then=F('unit_amount')),
+            default=F('base_amount'))
+    ).values(
+        'name', 'measurement_unit', 'total_amount'
+    ).order_by('name', 'base_unit')
+
+
+def render_txt(rows):
+    """Построчно формирует список покупок в текстовом формате"""
+    for row in rows:
+        yield '{0} ({1}) - {2}\n'.format(
+            row['name'],
+            row['measurement_unit'],
+            row['total_amount']
+        )
+
+
+def render_csv(rows):
+    """Построчно формирует список покупок в формате csv"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(('название', 'единица измерения', 'количество'))
+    for row in rows:
+        yield writer.writerow((
+            row['name'],
+            row['measurement_unit'],
+            row['total_amount']
+        ))
+
+
+def render_json(rows):
+    """Построчно формирует список покупок в формате json"""
+    yield '['
+    for index, row in enumerate(rows):
+        item = json.dumps({
+            'name': row['name'],
+            'measurement_unit': row['measurement_unit'],
+            'amount': row['total_amount']
+        }, ensure_ascii=False)
+        yield f',\n{item}' if index else f'\n{item}'
+    yield '\n]\n'
+
+
+def spool(chunks, max_size=SPOOL_MAX_SIZE):
+    """Записывает части списка покупок во временный файл, который хранится
+    в памяти, пока не превысит max_size байт, и возвращает его с начала"""
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        file.write(chunk.encode())
+    file.seek(0)
+    return file
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=UTF-8'),
+    'csv': (render_csv, 'text/csv; charset=UTF-8'),
+    'json': (render_json, 'application/json; charset=UTF-8'),
+}
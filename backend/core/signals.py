@@ -0,0 +1,210 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.authentication import credentials_generation
+from core.cache import bump_generation
+from core.conditional import relations_changed
+from core.counters import suspended
+from core.feed import fan_out, subscriptions_changed
+from core.models import Tag, Ingredient
+from core.recipe_index import record_change
+from recipes.models import Recipe, IngredientInRecipe, Favorite, ShoppingCart
+from users.models import User, Subscribe
+
+GENERATIONS = {
+    Ingredient: 'ingredients',
+    Tag: 'tags',
+    Recipe: 'recipes',
+    IngredientInRecipe: 'recipes',
+    Recipe.tags.through: 'recipes',
+    User: 'users',
+}
+# поля пользователя, которые выводятся в рецептах как данные автора
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(connection_created)
+def register_sqlite_functions(connection, **kwargs):
+    """Регистрирует в SQLite функцию UNICODE_LOWER для поиска рецептов
+    без учета регистра любых букв"""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'UNICODE_LOWER', 1,
+            lambda value: value if value is None else value.lower(),
+            deterministic=True)
+
+
+def bump_on_commit(sender):
+    """Меняет поколение данных после фиксации транзакции, чтобы
+    параллельный запрос не закэшировал старые данные как новые"""
+    name = GENERATIONS[sender]
+    transaction.on_commit(lambda: bump_generation(name))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def data_changed(sender, **kwargs):
+    """Сбрасывает индекс ингредиентов и кэш ответов при изменении данных"""
+    bump_on_commit(sender)
+
+
+def revoke_credentials(user_id):
+    """Сбрасывает запомненных пользователей токенов после фиксации
+    транзакции"""
+    transaction.on_commit(
+        lambda: bump_generation(credentials_generation(user_id)))
+
+
+@receiver(pre_save, sender=User)
+def user_saving(instance, update_fields=None, **kwargs):
+    """Запоминает сохраненные в базе данные автора, чтобы после
+    сохранения сравнить их с новыми"""
+    fields = [field for field in AUTHOR_FIELDS
+              if update_fields is None or field in update_fields]
+    instance._stored_author = None
+    if not instance._state.adding and fields:
+        instance._stored_author = User.objects.filter(
+            pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Сбрасывает кэш аутентификации при изменении пользователя
+    (в том числе пароля и активности), кроме обновления времени входа.
+    Кэш ответов сбрасывается и дата изменения рецептов автора
+    обновляется, только если изменились данные автора в рецептах:
+    у нового пользователя рецептов нет"""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+
+    if not created:
+        revoke_credentials(instance.id)
+    stored = getattr(instance, '_stored_author', None) or {}
+    if any(getattr(instance, field) != value
+           for field, value in stored.items()):
+        bump_on_commit(sender)
+        instance.recipes.touch()
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    """Сбрасывает кэш аутентификации при выходе пользователя"""
+    revoke_credentials(instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def composition_changed(sender, instance, **kwargs):
+    """Записывает изменение состава рецепта в журнал обратного индекса
+    ингредиентов после фиксации транзакции"""
+    recipe_id = instance.id if sender is Recipe else instance.recipe_id
+    transaction.on_commit(lambda: record_change(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    """Раскладывает новый рецепт по лентам подписчиков автора после
+    фиксации транзакции"""
+    if created:
+        transaction.on_commit(lambda: fan_out(instance))
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribed(instance, created, **kwargs):
+    """Добавляет в ленту подписчика последние рецепты автора"""
+    if created:
+        subscriptions_changed(
+            instance.subscriber_id, [instance.author_id], 1)
+
+
+@receiver(post_delete, sender=Subscribe)
+def unsubscribed(instance, **kwargs):
+    """Убирает из ленты подписчика рецепты автора"""
+    if suspended.get():
+        return
+
+    subscriptions_changed(instance.subscriber_id, [instance.author_id], -1)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredient_changed(instance, origin=None, **kwargs):
+    """Обновляет дату изменения рецепта при изменении его ингредиентов,
+    кроме удаления вместе с рецептом или его автором. При отключенных
+    счетчиках рецепт сохраняет вызывающий код"""
+    if suspended.get():
+        return
+
+    if getattr(origin, 'model', type(origin)) not in (Recipe, User):
+        Recipe.objects.filter(id=instance.recipe_id).touch()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    """Обновляет дату изменения рецептов при изменении их тегов"""
+    if suspended.get():
+        return
+
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Recipe.objects.filter(id=instance.id).touch()
+    elif action in ('post_add', 'post_remove'):
+        Recipe.objects.filter(id__in=pk_set).touch()
+    elif action == 'pre_clear':
+        instance.recipes.touch()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(instance, **kwargs):
+    """Обновляет дату изменения рецептов с измененным тегом"""
+    instance.recipes.touch()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(instance, created, **kwargs):
+    """Обновляет дату изменения рецептов с измененным ингредиентом"""
+    if not created:
+        Recipe.objects.filter(
+            ingredients_in_recipes__ingredient=instance).touch()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_relation_changed(sender, instance, **kwargs):
+    """Меняет поколение связей пользователя с рецептами, от которых
+    зависят признаки рецептов в его ответах и сортировка по популярности"""
+    if kwargs.get('created') is False or suspended.get():
+        return
+
+    if sender is Favorite:
+        relations_changed(instance.user_id, 'favorites')
+    else:
+        relations_changed(instance.user_id)
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def subscription_changed(instance, **kwargs):
+    """Меняет поколение связей подписчика, от которого зависит признак
+    подписки на авторов в его ответах"""
+    if kwargs.get('created') is False or suspended.get():
+        return
+
+    relations_changed(instance.subscriber_id)
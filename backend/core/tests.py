@@ -0,0 +1,239 @@
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from array import array
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.authentication import credentials_generation
+from core.cache import get_generation
+from core.checks import shared_cache_check
+from core.models import Ingredient
+from core.recipe_index import (ARRAY_TYPE, RecipeIngredientIndex,
+                               record_change, with_recipe, without_recipe)
+from recipes.models import IngredientInRecipe, Recipe
+from users.models import User
+
+
+class RecipeIngredientIndexTests(TestCase):
+    """Поиск по имеющимся ингредиентам сравнивается с ранжированием
+    перебором всех рецептов"""
+    recipes_count = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com')
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(30)
+        ])
+        recipes = Recipe.objects.bulk_create([
+            Recipe(author=author, name=f'рецепт {number}', text='текст',
+                   image='recipes/images/test.png', cooking_time=10)
+            for number in range(cls.recipes_count)
+        ])
+        # первые ингредиенты частые и хранятся битовыми картами,
+        # последние редкие и хранятся массивами
+        generator = random.Random(42)
+        weights = [1 / (number + 1) ** 2 for number in range(30)]
+        rows = []
+        for recipe in recipes:
+            chosen = set(generator.choices(
+                cls.ingredients, weights, k=generator.randint(1, 8)))
+            rows.extend(IngredientInRecipe(
+                recipe=recipe, ingredient=ingredient, amount=1)
+                for ingredient in chosen)
+        IngredientInRecipe.objects.bulk_create(rows)
+
+    def setUp(self):
+        self.index = RecipeIngredientIndex()
+        self.generator = random.Random(7)
+
+    def brute_force(self, ingredient_ids, max_missing=None):
+        compositions = {}
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.values_list(
+                'recipe_id', 'ingredient_id'):
+            compositions.setdefault(recipe_id, set()).add(ingredient_id)
+        ranked = []
+        for recipe_id, composition in compositions.items():
+            matched = len(composition & set(ingredient_ids))
+            missing = len(composition) - matched
+            if matched and (max_missing is None or missing <= max_missing):
+                ranked.append((missing, -matched, -recipe_id))
+        return [-recipe_id for _, _, recipe_id in sorted(ranked)]
+
+    def random_query(self):
+        return [ingredient.id for ingredient in self.generator.sample(
+            self.ingredients, self.generator.randint(1, 10))]
+
+    def assert_matches_brute_force(self, ingredient_ids, max_missing=None):
+        expected = self.brute_force(ingredient_ids, max_missing)
+        result = self.index.search(ingredient_ids, max_missing)
+        self.assertEqual(len(result), len(expected))
+        self.assertEqual(result[:len(result)], expected)
+        pages = []
+        for start in range(0, len(expected), 7):
+            pages.extend(result[start:start + 7])
+        self.assertEqual(pages, expected)
+
+    def test_ranking(self):
+        for _ in range(30):
+            self.assert_matches_brute_force(self.random_query())
+
+    def test_max_missing(self):
+        for max_missing in (0, 1, 3):
+            for _ in range(10):
+                self.assert_matches_brute_force(
+                    self.random_query(), max_missing)
+
+    def test_unknown_ingredients(self):
+        result = self.index.search([0, 10 ** 6])
+        self.assertEqual(len(result), 0)
+        self.assertEqual(result[:10], [])
+
+    def test_journal_changes(self):
+        """Изменения составов, записанные в журнал, применяются
+        без перестройки индекса"""
+        self.index.search([self.ingredients[0].id])
+        recipes = list(Recipe.objects.order_by('?')[:20])
+        for recipe in recipes[:10]:
+            recipe.ingredients_in_recipes.all().delete()
+        for recipe in recipes[10:]:
+            recipe.ingredients_in_recipes.all().delete()
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=1)
+                for ingredient in self.generator.sample(self.ingredients, 5))
+        for recipe in recipes:
+            record_change(recipe.id)
+
+        build = self.index._build
+        self.index._build = None
+        try:
+            for _ in range(20):
+                self.assert_matches_brute_force(self.random_query())
+        finally:
+            self.index._build = build
+
+    def test_changes_do_not_modify_searched_state(self):
+        """Журнал применяется к копиям: поиск, который уже прочитал
+        индекс, видит его прежним"""
+        self.index.search([self.ingredients[0].id])
+        postings, sizes = self.index._state
+        snapshot = ({key: value if isinstance(value, int) else list(value)
+                     for key, value in postings.items()}, dict(sizes))
+        for recipe in Recipe.objects.order_by('?')[:10]:
+            recipe.ingredients_in_recipes.all().delete()
+            record_change(recipe.id)
+
+        self.assert_matches_brute_force(self.random_query())
+        self.assertIsNot(self.index._state[0], postings)
+        self.assertEqual(
+            {key: value if isinstance(value, int) else list(value)
+             for key, value in postings.items()}, snapshot[0])
+        self.assertEqual(sizes, snapshot[1])
+
+    def test_large_recipe_ids(self):
+        recipes = array(ARRAY_TYPE, [5, 2 ** 40])
+        added = with_recipe(recipes, 2 ** 33)
+        self.assertEqual(list(added), [5, 2 ** 33, 2 ** 40])
+        self.assertEqual(list(without_recipe(added, 5)), [2 ** 33, 2 ** 40])
+        self.assertEqual(list(recipes), [5, 2 ** 40])
+
+
+class UserGenerationTests(TestCase):
+    """Кэш ответов с рецептами сбрасывается только при изменении данных
+    автора, кэш аутентификации - при любом изменении пользователя"""
+
+    def save(self, user, **kwargs):
+        users = get_generation('users')
+        credentials = get_generation(credentials_generation(user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(**kwargs)
+        return (get_generation('users') != users,
+                get_generation(credentials_generation(user.id))
+                != credentials)
+
+    def test_signup(self):
+        users = get_generation('users')
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(
+                username='new', email='new@example.com', password='secret')
+        self.assertEqual(get_generation('users'), users)
+
+    def test_changes(self):
+        user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret')
+        self.assertEqual(self.save(user), (False, True))
+        user.set_password('another secret')
+        self.assertEqual(self.save(user), (False, True))
+        user.is_active = False
+        self.assertEqual(self.save(user, update_fields=['is_active']),
+                         (False, True))
+        user.first_name = 'Повар'
+        self.assertEqual(self.save(user), (True, True))
+        user.username = 'chef'
+        self.assertEqual(self.save(user, update_fields=['username']),
+                         (True, True))
+        self.assertEqual(self.save(user, update_fields=['last_login']),
+                         (False, False))
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    """Проверка общего кэша при нескольких воркерах gunicorn"""
+    locmem = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    shared = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/foodgram'}}
+
+    def test_check(self):
+        for workers, caches, errors in ((1, self.locmem, []),
+                                        (4, self.shared, []),
+                                        (4, self.locmem, ['core.E001'])):
+            with self.subTest(workers=workers, caches=caches):
+                with override_settings(GUNICORN_WORKERS=workers,
+                                       CACHES=caches):
+                    self.assertEqual(
+                        [error.id for error in shared_cache_check(None)],
+                        errors)
+
+
+# Запрос и чтение метрик в отдельном процессе, который загружает
+# конфигурацию gunicorn так же, как мастер процесс перед запуском воркеров
+SCRAPE_METRICS = """
+import runpy
+
+import django
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+config = runpy.run_path('gunicorn.conf.py')
+config['on_starting'](None)
+django.setup()
+setup_test_environment()
+client = Client()
+client.get('/api/metrics/')
+print(client.get('/api/metrics/').content.decode())
+"""
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+    """Метрики воркеров gunicorn сохраняются в общем каталоге
+    и отдаются эндпоинтом /api/metrics/"""
+
+    def test_metrics_after_request(self):
+        with tempfile.TemporaryDirectory() as path:
+            env = dict(os.environ, TMPDIR=path)
+            env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+            result = subprocess.run(
+                [sys.executable, '-c', SCRAPE_METRICS], env=env,
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+                check=True)
+            self.assertTrue(os.listdir(os.path.join(path, 'prometheus')))
+        self.assertIn('foodgram_requests_total{method="GET",status="200",'
+                      'view="metrics"} 1.0', result.stdout)
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+# Каталог, в котором процессы gunicorn сохраняют метрики Prometheus,
+# эндпоинт /api/metrics/ суммирует значения всех процессов.
+# prometheus_client выбирает способ хранения значений при импорте,
+# поэтому переменная задается до первого импорта библиотеки
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'prometheus'))
+
+# Режим сервера: sync - синхронные воркеры WSGI, asgi - воркеры uvicorn,
+# в которых GET запросы обслуживают асинхронные вьюхи
+if os.getenv('SERVER_MODE', 'sync') == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'backend.wsgi:application'
+bind = '0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+
+
+def on_starting(server):
+    """Очищает метрики предыдущего запуска"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Удаляет метрики gauge завершившегося процесса"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -12,8 +12,9 @@ class RecipeAdmin(admin.ModelAdmin):
     """Модель рецептов в админке"""
     list_display = ('name', 'author', 'in_favorite')
     list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
 
+    @admin.display(description='в избранном', ordering='favorites_count')
     def in_favorite(self, obj):
         """Показывает сколько раз рецепт был добавлен в избранное"""
-        count = obj.in_favorite.all().count()
-        return count
+        return obj.favorites_count
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Команда для обработки изображений рецептов, которые не были
+    обработаны в фоне, например из-за перезапуска сервера"""
+    help = 'convert recipe images and create missing thumbnails'
+
+    def handle(self, *args, **options):
+        recipes_id = Recipe.objects.filter(
+            image_small=''
+        ).exclude(image='').values_list('id', flat=True)
+        processed = 0
+        for recipe_id in recipes_id.iterator():
+            process_recipe_image(recipe_id)
+            processed += 1
+
+        self.stdout.write(f'images successfully processed: {processed}')
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0003_alter_favorite_recipe_alter_favorite_user_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_medium",
+            field=models.ImageField(
+                blank=True,
+                editable=False,
+                upload_to="core/images/",
+                verbose_name="изображение среднего размера",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="image_small",
+            field=models.ImageField(
+                blank=True,
+                editable=False,
+                upload_to="core/images/",
+                verbose_name="миниатюра изображения",
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_favorites_count(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Favorite = apps.get_model("recipes", "Favorite")
+    favorites = (
+        Favorite.objects.filter(recipe=OuterRef("pk"))
+        .order_by()
+        .values("recipe")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Recipe.objects.update(favorites_count=Coalesce(Subquery(favorites), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0004_recipe_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="favorites_count",
+            field=models.IntegerField(
+                db_index=True, default=0, editable=False, verbose_name="в избранном"
+            ),
+        ),
+        migrations.RunPython(fill_favorites_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:42
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Поисковый вектор поддерживается триггером, поэтому обновляется при любой
+# записи названия или описания, в том числе через bulk_create и update
+CREATE_SEARCH_VECTOR = [
+    """
+    CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('pg_catalog.russian',
+                                  coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('pg_catalog.russian',
+                                     coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, text, search_vector
+    ON recipes_recipe
+    FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector()
+    """,
+    "UPDATE recipes_recipe SET search_vector = NULL",
+    """
+    CREATE INDEX recipe_search_vector_idx
+    ON recipes_recipe USING GIN (search_vector)
+    """,
+]
+
+DROP_SEARCH_VECTOR = [
+    "DROP INDEX IF EXISTS recipe_search_vector_idx",
+    "DROP TRIGGER IF EXISTS recipes_recipe_search_vector_update "
+    "ON recipes_recipe",
+    "DROP FUNCTION IF EXISTS recipes_recipe_search_vector()",
+]
+
+
+def create_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for statement in CREATE_SEARCH_VECTOR:
+            schema_editor.execute(statement)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for statement in DROP_SEARCH_VECTOR:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0006_recipe_user_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="поисковый вектор"
+            ),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -1,12 +1,112 @@
-from django.db import models
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.conf import settings
+from django.db import connections, models
+from django.db.models.functions import Lower
+from django.db.models.lookups import Contains
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
+from core.counters import CounterFieldsMixin
 from core.models import Tag, Ingredient
-from users.models import User
+from users.models import User, Subscribe
 
+SEARCH_CONFIG = 'russian'
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart', 'is_subscribed')
 
-class Recipe(models.Model):
+
+class UnicodeLower(Lower):
+    """Нижний регистр строки. Встроенная функция LOWER в SQLite меняет
+    регистр только латиницы, поэтому там используется функция
+    UNICODE_LOWER, которую регистрирует core.signals"""
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              function='UNICODE_LOWER', **extra_context)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов"""
+    def with_related(self, author=True, tags=True, ingredients=True):
+        """Подгружает автора, теги и ингредиенты рецептов
+        фиксированным числом запросов, ненужные ответу связи
+        можно не подгружать"""
+        queryset = self.defer('search_vector')
+        if author:
+            queryset = queryset.select_related('author')
+        lookups = [lookup for lookup, needed in (
+            ('tags', tags),
+            ('ingredients_in_recipes__ingredient', ingredients)
+        ) if needed]
+        return queryset.prefetch_related(*lookups)
+
+    def with_user_flags(self, user, flags=USER_FLAGS):
+        """Добавляет к рецептам признаки избранного, списка покупок
+        и подписки на автора для переданного пользователя,
+        flags ограничивает добавляемые признаки"""
+        if not user.is_authenticated:
+            return self.annotate(**{
+                flag: models.Value(False) for flag in flags})
+
+        subqueries = {
+            'is_favorited': Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')),
+            'is_in_shopping_cart': ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')),
+            'is_subscribed': Subscribe.objects.filter(
+                subscriber=user, author=models.OuterRef('author'))
+        }
+        return self.annotate(**{
+            flag: models.Exists(subqueries[flag]) for flag in flags})
+
+    def search(self, text):
+        """Полнотекстовый поиск по названию и описанию с сортировкой
+        по релевантности. В PostgreSQL использует поисковый вектор
+        с GIN индексом, в остальных базах ищет вхождение каждого слова.
+        Ранжируется не более RECIPE_SEARCH_MAX_RESULTS последних
+        совпадений"""
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(text, config=SEARCH_CONFIG,
+                                search_type='websearch')
+            matches = self.filter(search_vector=query)
+            rank = SearchRank(models.F('search_vector'), query)
+        else:
+            # icontains в SQLite не учитывает регистр только латиницы,
+            # поэтому обе стороны приводятся к нижнему регистру
+            matches = self.alias(search_name=UnicodeLower('name'),
+                                 search_text=UnicodeLower('text'))
+            for word in text.lower().split():
+                matches = matches.filter(
+                    models.Q(search_name__contains=word)
+                    | models.Q(search_text__contains=word))
+            rank = models.Case(
+                models.When(Contains(UnicodeLower('name'), text.lower()),
+                            then=models.Value(1.0)),
+                default=models.Value(0.0),
+                output_field=models.FloatField())
+
+        # ранжируются только последние совпадения, иначе запрос
+        # с частым словом считает ts_rank для сотен тысяч рецептов
+        latest = matches.order_by('-pub_date').values(
+            'pk')[:settings.RECIPE_SEARCH_MAX_RESULTS]
+        return self.filter(pk__in=models.Subquery(latest)).annotate(
+            search_rank=rank
+        ).order_by('-search_rank', '-pub_date')
+
+    def touch(self):
+        """Отмечает изменение представления рецептов, например, тегов
+        или ингредиентов, без сохранения каждого рецепта"""
+        return self.update(updated_at=timezone.now())
+
+    def latest_per_author(self, limit):
+        """Оставляет не более limit последних рецептов каждого автора"""
+        latest = Recipe.objects.filter(
+            author=models.OuterRef('author')).values('pk')[:limit]
+        return self.filter(pk__in=models.Subquery(latest))
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецептов"""
+    counter_fields = ('favorites_count',)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -18,6 +118,18 @@ class Recipe(models.Model):
         upload_to='core/images/',
         verbose_name='изображение'
     )
+    image_medium = models.ImageField(
+        upload_to='core/images/',
+        blank=True,
+        editable=False,
+        verbose_name='изображение среднего размера'
+    )
+    image_small = models.ImageField(
+        upload_to='core/images/',
+        blank=True,
+        editable=False,
+        verbose_name='миниатюра изображения'
+    )
     text = models.TextField(verbose_name='описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -38,6 +150,23 @@ class Recipe(models.Model):
         db_index=True,
         verbose_name='дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='дата изменения'
+    )
+    favorites_count = models.IntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='в избранном'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='поисковый вектор'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'рецепт'
@@ -101,6 +230,10 @@ class Favorite(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique_favorite')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='favorite_recipe_user_idx')
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
@@ -127,6 +260,53 @@ class ShoppingCart(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique_shopping_cart')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='shopping_cart_recipe_user_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """Модель ленты подписок: рецепт автора, на которого подписан
+    пользователь. Дата публикации копируется из рецепта, чтобы лента
+    выводилась по индексу без соединения с рецептами"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        db_index=False,
+        verbose_name='пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор'
+    )
+    pub_date = models.DateTimeField(verbose_name='дата публикации')
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_feed_entry')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author_idx')
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
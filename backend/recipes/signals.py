@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.counters import change_counter, suspended
+from recipes.models import Recipe, Favorite
+from users.models import User
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(instance, created, **kwargs):
+    """Увеличивает счетчик добавлений рецепта в избранное"""
+    if created:
+        change_counter(Recipe, 'favorites_count', [instance.recipe_id])
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(instance, **kwargs):
+    """Уменьшает счетчик добавлений рецепта в избранное"""
+    if suspended.get():
+        return
+
+    change_counter(Recipe, 'favorites_count', [instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    """Увеличивает счетчик рецептов автора"""
+    if created:
+        change_counter(User, 'recipes_count', [instance.author_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    """Уменьшает счетчик рецептов автора"""
+    if suspended.get():
+        return
+
+    change_counter(User, 'recipes_count', [instance.author_id], -1)
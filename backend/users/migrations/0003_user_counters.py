@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_user_counters(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    Subscribe = apps.get_model("users", "Subscribe")
+    Recipe = apps.get_model("recipes", "Recipe")
+    recipes = (
+        Recipe.objects.filter(author=OuterRef("pk"))
+        .order_by()
+        .values("author")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    followers = (
+        Subscribe.objects.filter(author=OuterRef("pk"))
+        .order_by()
+        .values("author")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    User.objects.update(
+        recipes_count=Coalesce(Subquery(recipes), 0),
+        followers_count=Coalesce(Subquery(followers), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_alter_subscribe_author_alter_subscribe_subscriber_and_more"),
+        ("recipes", "0005_recipe_favorites_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="followers_count",
+            field=models.IntegerField(
+                default=0, editable=False, verbose_name="количество подписчиков"
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="recipes_count",
+            field=models.IntegerField(
+                default=0, editable=False, verbose_name="количество рецептов"
+            ),
+        ),
+        migrations.RunPython(fill_user_counters, migrations.RunPython.noop),
+    ]
@@ -2,9 +2,12 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 
+from core.counters import CounterFieldsMixin
 
-class User(AbstractUser):
+
+class User(CounterFieldsMixin, AbstractUser):
     """Модель пользователей"""
+    counter_fields = ('recipes_count', 'followers_count')
     USERNAME_FIELD = 'email'
     email = models.EmailField(
         unique=True,
@@ -20,6 +23,16 @@ class User(AbstractUser):
     password = models.CharField(max_length=150, verbose_name='пароль')
     first_name = models.CharField(max_length=150, verbose_name='имя')
     last_name = models.CharField(max_length=150, verbose_name='фамилия')
+    recipes_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='количество рецептов'
+    )
+    followers_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='количество подписчиков'
+    )
 
     class Meta:
         verbose_name = 'пользователь'
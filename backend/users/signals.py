@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.counters import change_counter, suspended
+from users.models import User, Subscribe
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_created(instance, created, **kwargs):
+    """Увеличивает счетчик подписчиков автора"""
+    if created:
+        change_counter(User, 'followers_count', [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_deleted(instance, **kwargs):
+    """Уменьшает счетчик подписчиков автора"""
+    if suspended.get():
+        return
+
+    change_counter(User, 'followers_count', [instance.author_id], -1)